@@ -5,13 +5,30 @@ import json
 import schedule
 import time
 import threading
+import queue
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin, urlparse
 import random
+import signal
+import uuid
+import multiprocessing
+import sqlite3
+import base64
+import hashlib
+import hmac
+import heapq
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, TimeoutError as FutureTimeoutError
 from linebot import LineBotApi, WebhookHandler
+from linebot.webhook import WebhookPayload
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 from flask import Flask, request, abort, jsonify
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
 
 # 出勤查詢相關套件
 from selenium import webdriver
@@ -21,8 +38,12 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import StaleElementReferenceException, WebDriverException
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from cryptography.fernet import Fernet, InvalidToken
 import re
+import unicodedata
 from datetime import timedelta
 
 app = Flask(__name__)
@@ -47,6 +68,165 @@ WIFE_USER_ID = USERS['wife']
 # 出勤查詢設定 - 從環境變數取得
 FUTAI_USERNAME = os.environ.get('FUTAI_USERNAME')
 FUTAI_PASSWORD = os.environ.get('FUTAI_PASSWORD')
+# 🆕 富台網址可設定（例如指向本機的 futai_replay_server.py 做離線測試）
+FUTAI_EPORTAL_BASE = os.environ.get('FUTAI_EPORTAL_BASE', 'https://eportal.futai.com.tw').rstrip('/')
+FUTAI_BPMFLOW_BASE = os.environ.get('FUTAI_BPMFLOW_BASE', 'https://bpmflow.futai.com.tw').rstrip('/')
+FUTAI_SIGNON_PATH = os.environ.get(
+    'FUTAI_SIGNON_PATH',
+    '/futaibpmflow/SignOnFutai.aspx?Account=2993&Token=QxY%2BV82RudxNLWk6ZPWQdiDWxUmcDvnLTJUKvhMIG08%3D&FunctionID=AB-ABS-04'
+)
+FUTAI_LOGIN_URL = f'{FUTAI_EPORTAL_BASE}/Home/Login?ReturnUrl=%2F'
+FUTAI_SIGNON_URL = f'{FUTAI_BPMFLOW_BASE}{FUTAI_SIGNON_PATH}'
+
+# 🆕 其他富台帳號（JSON 陣列），每個帳號的出勤結果推播給對應的 LINE 使用者：
+# [{"username": "3001", "password": "...", "label": "小明", "subscribers": ["Uxxxx"]}]
+FUTAI_EXTRA_ACCOUNTS = json.loads(os.environ.get('FUTAI_ACCOUNTS', '[]'))
+FUTAI_ACCOUNT_PARALLELISM = int(os.environ.get('FUTAI_ACCOUNT_PARALLELISM', 4))  # 同時進行的分頁／HTTP 連線數
+
+# 🆕 出勤查詢後端：http（預設，失敗時改用 selenium）/ selenium / shadow（兩者都跑並比對結果）
+ATTENDANCE_BACKEND = os.environ.get('ATTENDANCE_BACKEND', 'http').lower()
+FUTAI_HTTP_TIMEOUT = int(os.environ.get('FUTAI_HTTP_TIMEOUT', 15))
+
+# 🆕 各等待階段的上限（秒），頁面就緒即繼續，不再固定 sleep
+FUTAI_WAIT_LOGIN = float(os.environ.get('FUTAI_WAIT_LOGIN', 15))
+FUTAI_WAIT_QUERY_PAGE = float(os.environ.get('FUTAI_WAIT_QUERY_PAGE', 15))
+FUTAI_WAIT_RESULT = float(os.environ.get('FUTAI_WAIT_RESULT', 20))
+FUTAI_RESULT_TABLE_CSS = "table[width='566'][border='1']"
+
+# 🆕 結果擷取模式：script（在頁面內以 JS 取出表格列）/ page_source（傳回整頁 HTML 再解析）
+FUTAI_EXTRACT_MODE = os.environ.get('FUTAI_EXTRACT_MODE', 'script').lower()
+
+# 🆕 出勤 HTML 解析器：lxml（只解析結果表格，較快）/ bs4（原本的 BeautifulSoup 解析）
+ATTENDANCE_PARSER = os.environ.get('ATTENDANCE_PARSER', 'lxml').lower()
+
+# 🆕 出勤結果快取 TTL（秒）：已刷卡資料 / 尚未刷卡（查無資料）
+ATTENDANCE_CACHE_TTL = int(os.environ.get('ATTENDANCE_CACHE_TTL', 600))
+ATTENDANCE_CACHE_NEGATIVE_TTL = int(os.environ.get('ATTENDANCE_CACHE_NEGATIVE_TTL', 60))
+
+# 🆕 出勤歷史回補：每段查詢的天數、管理端點用的 token（未設定時管理端點一律返回 403）
+ATTENDANCE_BACKFILL_CHUNK_DAYS = int(os.environ.get('ATTENDANCE_BACKFILL_CHUNK_DAYS', 7))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# 🆕 本機 SQLite 資料庫（出勤紀錄等）
+BOT_DB_PATH = os.environ.get('BOT_DB_PATH', 'bot_data.db')
+
+# 🆕 Chrome 網路層資源封鎖（圖片、字型、影音、追蹤腳本），可用 CHROME_BLOCKED_URLS 追加逗號分隔的 URL 樣式
+CHROME_BLOCK_RESOURCES = os.environ.get('CHROME_BLOCK_RESOURCES', '1') == '1'
+CHROME_BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3', '*.wav', '*.ogg',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+] + [pattern.strip() for pattern in os.environ.get('CHROME_BLOCKED_URLS', '').split(',') if pattern.strip()]
+CHROME_PAGE_METRICS = os.environ.get('CHROME_PAGE_METRICS', '1') == '1'
+
+# 🆕 富台登入 cookies 加密保存（FUTAI_COOKIE_KEY 為 Fernet 金鑰，未設定時由帳密衍生）
+FUTAI_COOKIE_FILE = os.environ.get('FUTAI_COOKIE_FILE', 'futai_session.bin')
+FUTAI_COOKIE_KEY = os.environ.get('FUTAI_COOKIE_KEY')
+FUTAI_COOKIE_MAX_AGE = int(os.environ.get('FUTAI_COOKIE_MAX_AGE', 8 * 3600))  # 沒有到期時間的 session cookie 最長保留秒數
+FUTAI_COOKIE_DOMAINS = ('futai.com.tw',) + tuple(
+    host for host in {urlparse(FUTAI_EPORTAL_BASE).hostname, urlparse(FUTAI_BPMFLOW_BASE).hostname}
+    if host and 'futai.com.tw' not in host
+)
+
+# 🆕 抓取工作程序：process（Chrome 只在獨立子程序中執行）/ inline（在 web 程序內執行）
+SCRAPE_WORKER_MODE = os.environ.get('SCRAPE_WORKER_MODE', 'process').lower()
+SCRAPE_WORKER_TIMEOUT = int(os.environ.get('SCRAPE_WORKER_TIMEOUT', 150))
+SCRAPE_WORKER_MAX_RSS_MB = int(os.environ.get('SCRAPE_WORKER_MAX_RSS_MB', 700))
+
+# 🆕 背景工作執行器：工作執行緒數、佇列上限、各類型並行上限（JSON，例如 {"backfill": 1}）
+# 抓取工作一律經由同一個抓取子程序依序執行（見 ScrapeWorker），調高 attendance 的上限只會讓更多執行緒排隊等待
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 4))
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 20))
+JOB_TYPE_QUEUE_LIMIT = int(os.environ.get('JOB_TYPE_QUEUE_LIMIT', 5))
+JOB_TYPE_LIMITS = {
+    'attendance': 1,
+    'backfill': 1,
+    'holiday_check': 1,
+    'care_check': 1,
+    'warm': 1,
+    'punch_poll': 1,
+    'message_pool_refill': 1,
+    **json.loads(os.environ.get('JOB_TYPE_LIMITS', '{}')),
+}
+
+# 🆕 富台系統斷路器：最近 N 次的失敗率達門檻即暫停查詢，之後以指數退避（含隨機抖動）試探
+FUTAI_BREAKER_WINDOW = int(os.environ.get('FUTAI_BREAKER_WINDOW', 10))
+FUTAI_BREAKER_MIN_CALLS = int(os.environ.get('FUTAI_BREAKER_MIN_CALLS', 3))
+FUTAI_BREAKER_FAILURE_RATE = float(os.environ.get('FUTAI_BREAKER_FAILURE_RATE', 0.5))
+FUTAI_BREAKER_SLOW_SECONDS = float(os.environ.get('FUTAI_BREAKER_SLOW_SECONDS', 90))
+FUTAI_BREAKER_BASE_COOLDOWN = int(os.environ.get('FUTAI_BREAKER_BASE_COOLDOWN', 60))
+FUTAI_BREAKER_MAX_COOLDOWN = int(os.environ.get('FUTAI_BREAKER_MAX_COOLDOWN', 1800))
+
+# 🆕 Webhook 事件背景處理：同一位使用者的事件依序處理，不同使用者可同時處理
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_LIMIT = int(os.environ.get('WEBHOOK_QUEUE_LIMIT', 100))
+
+# 🆕 Webhook 重送去重：記住最近處理過的事件 ID（LRU + TTL），可選擇寫入 SQLite 讓重啟後仍有效
+WEBHOOK_DEDUP_SIZE = int(os.environ.get('WEBHOOK_DEDUP_SIZE', 2000))
+WEBHOOK_DEDUP_TTL = int(os.environ.get('WEBHOOK_DEDUP_TTL', 6 * 3600))
+WEBHOOK_DEDUP_PERSIST = os.environ.get('WEBHOOK_DEDUP_PERSIST', '0') == '1'
+
+# 🆕 下午打卡輪詢：偵測實際下班刷卡，輪詢間隔依距離預估下班時間遠近調整（秒）
+PUNCH_POLL_ENABLED = os.environ.get('PUNCH_POLL_ENABLED', '1') == '1'
+PUNCH_POLL_WINDOW_START = os.environ.get('PUNCH_POLL_WINDOW_START', '14:00')
+PUNCH_POLL_OVERTIME_MINUTES = int(os.environ.get('PUNCH_POLL_OVERTIME_MINUTES', 180))  # 預估下班後繼續輪詢的分鐘數
+PUNCH_POLL_FAR_INTERVAL = int(os.environ.get('PUNCH_POLL_FAR_INTERVAL', 1800))  # 距離下班超過 1 小時
+PUNCH_POLL_NEAR_INTERVAL = int(os.environ.get('PUNCH_POLL_NEAR_INTERVAL', 600))  # 下班前 1 小時內
+PUNCH_POLL_CLOSE_INTERVAL = int(os.environ.get('PUNCH_POLL_CLOSE_INTERVAL', 180))  # 下班前 15 分鐘起
+PUNCH_POLL_SKIP_DATES = {  # 額外不輪詢的日期（國定假日、請假），逗號分隔的 YYYY-MM-DD
+    value.strip() for value in os.environ.get('PUNCH_POLL_SKIP_DATES', '').split(',') if value.strip()
+}
+PUNCH_CLOCK_OUT_MIN_HOURS = float(os.environ.get('PUNCH_CLOCK_OUT_MIN_HOURS', 6))  # 距上班至少幾小時的刷卡才視為下班
+
+# 🆕 預熱排程：在預定的 /auto/attendance 觸發時間前幾分鐘預先準備抓取流程，沒等到觸發就關閉
+PREWARM_ENABLED = os.environ.get('PREWARM_ENABLED', '1') == '1'
+PREWARM_TRIGGER_TIMES = [t.strip() for t in os.environ.get('PREWARM_TRIGGER_TIMES', '09:30,10:00').split(',') if t.strip()]
+PREWARM_LEAD_MINUTES = int(os.environ.get('PREWARM_LEAD_MINUTES', 5))
+PREWARM_IDLE_MINUTES = int(os.environ.get('PREWARM_IDLE_MINUTES', 10))  # 觸發時間過後多久沒等到觸發就關閉
+PREWARM_CHROME = os.environ.get('PREWARM_CHROME', '0' if ATTENDANCE_BACKEND == 'http' else '1') == '1'
+
+# 🆕 AI 回應快取：常見短訊息（早安、晚安、愛你…）依角色 + 正規化文字快取，每個 key 保留多個版本隨機挑選
+AI_CACHE_ENABLED = os.environ.get('AI_CACHE_ENABLED', '1') == '1'
+AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', 500))
+AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', 3 * 24 * 3600))
+AI_CACHE_VARIANTS = int(os.environ.get('AI_CACHE_VARIANTS', 3))
+AI_CACHE_MAX_MESSAGE_LEN = int(os.environ.get('AI_CACHE_MAX_MESSAGE_LEN', 12))  # 正規化後超過此長度的訊息不快取
+AI_CACHE_CONTEXT_MINUTES = float(os.environ.get('AI_CACHE_CONTEXT_MINUTES', 5))  # 最近這麼久內有對話時不使用快取，讓回應接續上下文
+
+# 🆕 AI 回覆時間預算：Gemini 超過預算秒數仍未回應時，先用 reply token 回覆簡短訊息，完成後再 push 真正的回答
+AI_REPLY_BUDGET = float(os.environ.get('AI_REPLY_BUDGET', 6))
+AI_REPLY_WORKERS = int(os.environ.get('AI_REPLY_WORKERS', 8))
+
+# 🆕 Gemini 請求排程：全域並行上限 + token bucket 限速（依 Gemini 配額調整），依角色優先（老婆 > 老公 > 其他 > 背景工作）
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 2))
+GEMINI_RATE_PER_MINUTE = float(os.environ.get('GEMINI_RATE_PER_MINUTE', 15))
+GEMINI_BURST = int(os.environ.get('GEMINI_BURST', 3))
+GEMINI_QUEUE_LIMIT = int(os.environ.get('GEMINI_QUEUE_LIMIT', 50))
+GEMINI_429_COOLDOWN = float(os.environ.get('GEMINI_429_COOLDOWN', 20))  # 收到 429 後暫停發送的秒數
+AI_REPLY_DEADLINE = float(os.environ.get('AI_REPLY_DEADLINE', 45))  # 排隊超過這麼久仍未送出就取消，改送備用回應
+AI_BACKGROUND_DEADLINE = float(os.environ.get('AI_BACKGROUND_DEADLINE', 600))  # 背景請求（摘要、訊息池）的排隊期限
+
+# 🆕 Gemini 模型與對話記憶：每位使用者保留最近幾輪對話，超過 token 預算時把較舊的對話濃縮成摘要
+GEMINI_MODEL_NAME = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+AI_MEMORY_MAX_TURNS = int(os.environ.get('AI_MEMORY_MAX_TURNS', 12))  # 一問一答算 2 則
+AI_MEMORY_TOKEN_BUDGET = int(os.environ.get('AI_MEMORY_TOKEN_BUDGET', 800))
+AI_MEMORY_IDLE_HOURS = float(os.environ.get('AI_MEMORY_IDLE_HOURS', 12))  # 超過這麼久沒聊天就清空記憶
+AI_MEMORY_SUMMARY_CHARS = int(os.environ.get('AI_MEMORY_SUMMARY_CHARS', 150))
+
+# 🆕 預先生成的歡迎／關心訊息池：離峰時段批次用 Gemini 生成，發送時直接取用；低於低水位時自動補充
+AI_MESSAGE_POOL_ENABLED = os.environ.get('AI_MESSAGE_POOL_ENABLED', '1') == '1'
+AI_MESSAGE_POOL_TARGET = int(os.environ.get('AI_MESSAGE_POOL_TARGET', 30))  # 每種訊息的目標數量
+AI_MESSAGE_POOL_LOW_WATER = int(os.environ.get('AI_MESSAGE_POOL_LOW_WATER', 8))
+AI_MESSAGE_POOL_MAX_USES = int(os.environ.get('AI_MESSAGE_POOL_MAX_USES', 2))  # 每則訊息最多使用次數，用完即淘汰
+AI_MESSAGE_POOL_BATCH = int(os.environ.get('AI_MESSAGE_POOL_BATCH', 10))  # 每次 Gemini 請求生成的數量
+AI_MESSAGE_POOL_REFILL_TIME = os.environ.get('AI_MESSAGE_POOL_REFILL_TIME', '03:30')
+
+# 🆕 Chrome 連線池設定
+CHROME_POOL_SIZE = int(os.environ.get('CHROME_POOL_SIZE', 1))
+CHROME_POOL_MAX_USES = int(os.environ.get('CHROME_POOL_MAX_USES', 30))
+CHROME_POOL_MAX_RSS_MB = int(os.environ.get('CHROME_POOL_MAX_RSS_MB', 450))
+CHROME_POOL_LEASE_TIMEOUT = int(os.environ.get('CHROME_POOL_LEASE_TIMEOUT', 120))
 
 # Line Bot API 設定
 line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
@@ -56,7 +236,7 @@ handler = WebhookHandler(CHANNEL_SECRET)
 GOOGLE_AI_API_KEY = os.environ.get('GOOGLE_AI_API_KEY')
 if GOOGLE_AI_API_KEY:
     genai.configure(api_key=GOOGLE_AI_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 
 # 節日資料
 IMPORTANT_DATES = {
@@ -85,6 +265,16 @@ def get_taiwan_today():
     return get_taiwan_now().date()
 
 
+def format_futai_date(date) -> str:
+    """轉成富台系統使用的日期格式，例如 2025/1/5"""
+    return f"{date.year}/{date.month}/{date.day}"
+
+
+def futai_date_to_iso(date_str: str) -> str:
+    """富台日期格式（2025/1/5）轉成 ISO 格式（2025-01-05），方便排序與索引"""
+    return datetime.datetime.strptime(date_str, '%Y/%m/%d').date().isoformat()
+
+
 def get_user_name(user_id: str) -> str:
     """根據 User ID 取得用戶名稱"""
     for name, uid in USERS.items():
@@ -215,6 +405,212 @@ def safe_print(message: str, level: str = "INFO"):
         print(f"[TIME_ERROR] [{level}] {message} (時間格式化錯誤: {e})")
 
 
+# ============== 🆕 新增：背景工作執行器 ==============
+
+class JobRejected(Exception):
+    """佇列已滿，工作被拒絕"""
+
+
+class JobExecutor:
+    """集中管理背景工作：固定數量的工作執行緒、各類型並行上限、佇列長度上限"""
+
+    def __init__(self, max_workers: int, queue_limit: int, type_queue_limit: int, type_limits: dict,
+                 history_size: int = 200):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.type_queue_limit = type_queue_limit
+        self.type_limits = type_limits
+        self.history_size = history_size
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._running_by_type = {}
+        self._workers_started = False
+        self.stats = {'submitted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0}
+
+    def _start_workers(self):
+        for index in range(self.max_workers):
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True).start()
+        self._workers_started = True
+
+    def submit(self, job_type: str, func, *args, **kwargs) -> str:
+        """送出工作並返回 job id；佇列已滿時拋出 JobRejected"""
+        with self._cond:
+            if not self._workers_started:
+                self._start_workers()
+
+            queued_same_type = sum(1 for job_id in self._pending if self._jobs[job_id]['type'] == job_type)
+            if len(self._pending) >= self.queue_limit or queued_same_type >= self.type_queue_limit:
+                self.stats['rejected'] += 1
+                safe_print(f"工作佇列已滿，拒絕 {job_type} 工作", "WARNING")
+                raise JobRejected(f"{job_type} 工作佇列已滿")
+
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'id': job_id,
+                'type': job_type,
+                'status': 'queued',
+                'created_at': get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S'),
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+                '_call': (func, args, kwargs),
+            }
+            self._pending.append(job_id)
+            self.stats['submitted'] += 1
+            self._trim_history()
+            self._cond.notify_all()
+
+        safe_print(f"已排入 {job_type} 工作 {job_id}", "DEBUG")
+        return job_id
+
+    def _trim_history(self):
+        """只保留最近的已結束工作紀錄"""
+        while len(self._jobs) > self.history_size:
+            oldest_id = next(iter(self._jobs))
+            if self._jobs[oldest_id]['status'] in ('queued', 'running'):
+                break
+            del self._jobs[oldest_id]
+
+    def _next_runnable(self):
+        for job_id in self._pending:
+            job_type = self._jobs[job_id]['type']
+            limit = self.type_limits.get(job_type, self.max_workers)
+            if self._running_by_type.get(job_type, 0) < limit:
+                self._pending.remove(job_id)
+                return job_id
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job_id = self._next_runnable()
+                while job_id is None:
+                    self._cond.wait()
+                    job_id = self._next_runnable()
+
+                job = self._jobs[job_id]
+                job['status'] = 'running'
+                job['started_at'] = get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')
+                self._running_by_type[job['type']] = self._running_by_type.get(job['type'], 0) + 1
+                func, args, kwargs = job.pop('_call')
+
+            try:
+                func(*args, **kwargs)
+                status, error = 'succeeded', None
+            except Exception as e:
+                safe_print(f"{job['type']} 工作 {job_id} 執行失敗：{e}", "ERROR")
+                status, error = 'failed', str(e)
+
+            with self._cond:
+                job['status'] = status
+                job['error'] = error
+                job['finished_at'] = get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')
+                self._running_by_type[job['type']] -= 1
+                self.stats[status] += 1
+                self._cond.notify_all()
+
+    def get(self, job_id: str):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if not key.startswith('_')}
+
+    def get_status(self) -> dict:
+        with self._cond:
+            return {
+                'max_workers': self.max_workers,
+                'queued': len(self._pending),
+                'running': {job_type: count for job_type, count in self._running_by_type.items() if count},
+                'queue_limit': self.queue_limit,
+                'type_limits': self.type_limits,
+                **self.stats,
+            }
+
+
+# 初始化背景工作執行器
+job_executor = JobExecutor(JOB_MAX_WORKERS, JOB_QUEUE_LIMIT, JOB_TYPE_QUEUE_LIMIT, JOB_TYPE_LIMITS)
+
+
+class OrderedEventQueue:
+    """🆕 依 key（LINE 使用者）分流的事件佇列：同一個 key 的事件依序處理，不同 key 由多個執行緒同時處理"""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._cond = threading.Condition()
+        self._queues = {}       # key -> deque[(送出時間, func, args)]
+        self._ready = deque()   # 有待處理事件且目前沒有執行緒在處理的 key
+        self._active = set()
+        self._size = 0
+        self._workers_started = False
+        self.stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'rejected': 0, 'max_wait_ms': 0}
+
+    def _start_workers(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._worker_loop, name=f"webhook-worker-{index}", daemon=True).start()
+        self._workers_started = True
+
+    def submit(self, key: str, func, *args):
+        """排入事件；佇列已滿時拋出 JobRejected"""
+        with self._cond:
+            if not self._workers_started:
+                self._start_workers()
+
+            if self._size >= self.queue_limit:
+                self.stats['rejected'] += 1
+                raise JobRejected("webhook 事件佇列已滿")
+
+            events = self._queues.setdefault(key, deque())
+            events.append((time.time(), func, args))
+            self._size += 1
+            self.stats['submitted'] += 1
+            if key not in self._active and len(events) == 1:
+                self._ready.append(key)
+                self._cond.notify()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                self._active.add(key)
+                submitted_at, func, args = self._queues[key].popleft()
+                self._size -= 1
+
+            wait_ms = (time.time() - submitted_at) * 1000
+            try:
+                func(*args)
+                outcome = 'processed'
+            except Exception as e:
+                safe_print(f"處理 webhook 事件失敗：{e}", "ERROR")
+                outcome = 'failed'
+
+            with self._cond:
+                self._active.discard(key)
+                self.stats[outcome] += 1
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], round(wait_ms))
+                if self._queues[key]:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+
+    def get_status(self) -> dict:
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'queued': self._size,
+                'active_users': len(self._active),
+                **self.stats,
+            }
+
+
+webhook_queue = OrderedEventQueue(WEBHOOK_WORKERS, WEBHOOK_QUEUE_LIMIT)
+
+
 # ============== OOP 重構：狀態管理類別 ==============
 
 class ReminderManager:
@@ -333,10 +729,26 @@ class CareManager:
 class WorkManager:
     """管理工作出勤相關的狀態"""
 
+    # 🆕 擴大時間視窗：從 2 分鐘改為 10 分鐘
+    REMINDER_CONFIGS = [
+        {'minutes': 60, 'desc': '1小時前', 'key': '60min', 'window': 600},
+        {'minutes': 30, 'desc': '30分鐘前', 'key': '30min', 'window': 600},
+        {'minutes': 10, 'desc': '10分鐘前', 'key': '10min', 'window': 600},
+        {'minutes': 5, 'desc': '5分鐘前', 'key': '5min', 'window': 600}
+    ]
+
     def __init__(self):
         self.daily_work_end_time = None
         self.work_end_reminders_set = False
         self.work_end_reminders_sent = set()
+        self.clocked_out_time = None
+
+    def get_work_end_datetime(self):
+        """🆕 今日預估下班時間（台灣時區 datetime），未設定時返回 None"""
+        if not self.daily_work_end_time:
+            return None
+        work_end_time = datetime.datetime.strptime(self.daily_work_end_time, '%H:%M').time()
+        return TAIWAN_TZ.localize(datetime.datetime.combine(get_taiwan_today(), work_end_time))
 
     def set_work_end_time(self, work_end_str: str):
         """設定今日下班時間"""
@@ -379,25 +791,16 @@ class WorkManager:
             safe_print("未設定下班時間，跳過下班提醒檢查", "DEBUG")
             return
 
-        try:
-            work_end_time = datetime.datetime.strptime(self.daily_work_end_time, '%H:%M').time()
-            today = get_taiwan_today()
-            work_end_datetime = datetime.datetime.combine(today, work_end_time)
-            work_end_datetime = TAIWAN_TZ.localize(work_end_datetime)
+        if self.clocked_out_time:
+            safe_print(f"已於 {self.clocked_out_time} 刷卡下班，跳過下班提醒檢查", "DEBUG")
+            return
 
+        try:
+            work_end_datetime = self.get_work_end_datetime()
             current_time = get_taiwan_now()
+            today_str = get_taiwan_today().strftime('%Y-%m-%d')
 
-            # 🆕 擴大時間視窗：從 2 分鐘改為 10 分鐘
-            reminder_configs = [
-                {'minutes': 60, 'desc': '1小時前', 'key': '60min', 'window': 600},
-                {'minutes': 30, 'desc': '30分鐘前', 'key': '30min', 'window': 600},
-                {'minutes': 10, 'desc': '10分鐘前', 'key': '10min', 'window': 600},
-                {'minutes': 5, 'desc': '5分鐘前', 'key': '5min', 'window': 600}
-            ]
-
-            today_str = today.strftime('%Y-%m-%d')
-
-            for config in reminder_configs:
+            for config in self.REMINDER_CONFIGS:
                 reminder_time = work_end_datetime - timedelta(minutes=config['minutes'])
                 reminder_id = f"work_end_{config['key']}_{today_str}"
 
@@ -412,11 +815,26 @@ class WorkManager:
         except Exception as e:
             safe_print(f"檢查下班提醒時發生錯誤: {e}", "ERROR")
 
+    def mark_clocked_out(self, clock_out_str: str) -> int:
+        """🆕 偵測到實際下班刷卡：取消今日尚未發送的下班提醒，返回取消的數量"""
+        today_str = get_taiwan_today().strftime('%Y-%m-%d')
+        cancelled = 0
+        for config in self.REMINDER_CONFIGS:
+            reminder_id = f"work_end_{config['key']}_{today_str}"
+            if reminder_id not in self.work_end_reminders_sent:
+                self.work_end_reminders_sent.add(reminder_id)
+                cancelled += 1
+
+        self.clocked_out_time = clock_out_str
+        safe_print(f"已於 {clock_out_str} 刷卡下班，取消 {cancelled} 個下班提醒", "INFO")
+        return cancelled
+
     def clear_work_end_records(self):
         """清除下班提醒相關記錄"""
         self.daily_work_end_time = None
         self.work_end_reminders_set = False
         self.work_end_reminders_sent.clear()
+        self.clocked_out_time = None
         safe_print("已清除下班提醒記錄", "INFO")
 
 
@@ -444,7 +862,12 @@ def send_wife_welcome_message():
         f"🎉 騷鵝寶貝！新的一天又見面了！\n\n每天能跟你聊天是我最幸福的事情～ 💕\n不管你今天遇到什麼，記得你的灰鵝永遠支持你！\n我愛你愛到月球再回來～ 🌙❤️\n\n台灣時間：{taiwan_time.strftime('%Y-%m-%d %H:%M:%S')}"
     ]
 
-    selected_message = random.choice(welcome_messages)
+    # 🆕 優先使用預先生成的訊息（不需等待 Gemini），訊息池空了才用內建範本
+    pooled_message = message_pool.take('welcome')
+    if pooled_message:
+        selected_message = f"{pooled_message}\n\n台灣時間：{taiwan_time.strftime('%Y-%m-%d %H:%M:%S')}"
+    else:
+        selected_message = random.choice(welcome_messages)
 
     try:
         line_bot_api.push_message(WIFE_USER_ID, TextSendMessage(text=selected_message))
@@ -496,6 +919,11 @@ def generate_care_message_for_wife(hours_since: int) -> str:
         f"💕 騷鵝寶貝～我們已經 {hours_since} 小時沒聊天了呢！\n\n灰鵝在鵝窩等你回家等到受不鳥了吶～ 🥺\n記得在外面要注意安全、多喝水唷！"
     ]
 
+    # 🆕 優先使用預先生成的訊息
+    pooled_message = message_pool.take('care')
+    if pooled_message:
+        return pooled_message.replace('{hours}', str(hours_since))
+
     return random.choice(messages)
 
 
@@ -515,9 +943,402 @@ def get_chrome_options():
     options.add_argument('--disable-renderer-backgrounding')
     options.add_argument('--disable-backgrounding-occluded-windows')
     options.add_argument('--window-size=1024,768')
+
+    if CHROME_BLOCK_RESOURCES:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+
     return options
 
 
+def apply_resource_blocking(driver):
+    """透過 DevTools Network.setBlockedURLs 在網路層擋掉不需要的資源"""
+    if not CHROME_BLOCK_RESOURCES:
+        return
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': CHROME_BLOCKED_URL_PATTERNS})
+        safe_print(f"已設定資源封鎖 ({len(CHROME_BLOCKED_URL_PATTERNS)} 個樣式)", "DEBUG")
+    except Exception as e:
+        safe_print(f"設定資源封鎖失敗: {e}", "WARNING")
+
+
+PAGE_METRICS_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+let bytes = nav ? (nav.transferSize || 0) : 0;
+for (const entry of resources) {
+    bytes += entry.transferSize || 0;
+}
+return {
+    load_ms: nav ? Math.round(nav.duration) : null,
+    transfer_bytes: bytes,
+    resources: resources.length
+};
+"""
+
+
+class PageLoadMetrics:
+    """記錄每個抓取階段的頁面載入時間與傳輸量（依是否封鎖資源分開統計，方便比較前後差異）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, driver, stage: str):
+        if not CHROME_PAGE_METRICS:
+            return
+        try:
+            metrics = driver.execute_script(PAGE_METRICS_SCRIPT)
+        except Exception as e:
+            safe_print(f"取得頁面載入資訊失敗: {e}", "DEBUG")
+            return
+
+        mode = 'blocked' if CHROME_BLOCK_RESOURCES else 'unblocked'
+        with self._lock:
+            stat = self._stats.setdefault(f"{stage}:{mode}", {
+                'count': 0, 'load_ms_total': 0, 'bytes_total': 0, 'resources_total': 0
+            })
+            stat['count'] += 1
+            stat['load_ms_total'] += metrics.get('load_ms') or 0
+            stat['bytes_total'] += metrics.get('transfer_bytes') or 0
+            stat['resources_total'] += metrics.get('resources') or 0
+
+        safe_print(f"[頁面] {stage} ({mode}) 載入 {metrics.get('load_ms')}ms，"
+                   f"傳輸 {(metrics.get('transfer_bytes') or 0) / 1024:.1f}KB，"
+                   f"資源 {metrics.get('resources')} 個", "DEBUG")
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                key: {
+                    'count': stat['count'],
+                    'avg_load_ms': round(stat['load_ms_total'] / stat['count']),
+                    'avg_kb': round(stat['bytes_total'] / stat['count'] / 1024, 1),
+                    'avg_resources': round(stat['resources_total'] / stat['count'], 1),
+                }
+                for key, stat in self._stats.items()
+            }
+
+
+page_metrics = PageLoadMetrics()
+
+
+class StageTimer:
+    """記錄抓取流程各階段（啟動瀏覽器、登入、導覽、查詢、解析）的耗時，供效能測試收集"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            collector = getattr(self._local, 'collector', None)
+            if collector is not None:
+                collector[name] = collector.get(name, 0) + time.perf_counter() - start_time
+
+    @contextmanager
+    def collect(self):
+        """在此區塊內（同一執行緒）發生的階段耗時會累計到返回的 dict"""
+        collector = {}
+        self._local.collector = collector
+        try:
+            yield collector
+        finally:
+            self._local.collector = None
+
+
+scrape_stages = StageTimer()
+
+
+def get_process_tree_rss_mb(pid):
+    """計算某個程序及其所有子程序的 RSS（MB），讀取 /proc，無法取得時返回 None"""
+    try:
+        total_kb = 0
+        pending = [pid]
+        seen = set()
+
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+
+            task_dir = f'/proc/{current}/task'
+            for tid in os.listdir(task_dir):
+                try:
+                    with open(f'{task_dir}/{tid}/children') as f:
+                        pending.extend(int(child) for child in f.read().split())
+                except OSError:
+                    continue
+
+        return total_kb / 1024
+    except (OSError, ValueError):
+        return None
+
+
+class ChromeSession:
+    """一個常駐的 headless Chrome（保留登入狀態，可重複借用）"""
+
+    def __init__(self):
+        with scrape_stages.stage('driver_start'):
+            self.driver = webdriver.Chrome(options=get_chrome_options())
+            apply_resource_blocking(self.driver)
+        self.created_at = time.time()
+        self.use_count = 0
+        self.logged_in = False
+
+    def is_alive(self) -> bool:
+        """健康檢查：瀏覽器是否仍可回應"""
+        try:
+            _ = self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def rss_mb(self):
+        """chromedriver + Chrome 整棵程序樹的記憶體用量"""
+        try:
+            return get_process_tree_rss_mb(self.driver.service.process.pid)
+        except Exception:
+            return None
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            safe_print(f"關閉 Chrome 時發生錯誤: {e}", "WARNING")
+
+
+class ChromeSessionPool:
+    """管理常駐 Chrome 連線池：借出、健康檢查、達上限後回收並在背景重建"""
+
+    def __init__(self, size: int, max_uses: int, max_rss_mb: int):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._total = 0  # 已建立或建立中的 session 數
+        self.stats = {
+            'created': 0,
+            'recycled': 0,
+            'leases': 0,
+            'build_failures': 0,
+        }
+
+    def _build_session(self):
+        start_time = time.time()
+        try:
+            session = ChromeSession()
+        except Exception:
+            with self._lock:
+                self._total -= 1
+                self.stats['build_failures'] += 1
+            raise
+
+        with self._lock:
+            self.stats['created'] += 1
+        safe_print(f"Chrome session 建立完成 (耗時 {time.time() - start_time:.1f} 秒)", "INFO")
+        return session
+
+    def _reserve_slot(self) -> bool:
+        with self._lock:
+            if self._total < self.size:
+                self._total += 1
+                return True
+            return False
+
+    def _acquire(self, timeout: float):
+        deadline = time.time() + timeout
+
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve_slot():
+                    session = self._build_session()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError("等待 Chrome session 逾時")
+                    try:
+                        session = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        raise TimeoutError("等待 Chrome session 逾時")
+
+            if session.is_alive():
+                session.use_count += 1
+                with self._lock:
+                    self.stats['leases'] += 1
+                return session
+
+            self._discard(session, "健康檢查失敗")
+
+    def _release(self, session, broken: bool):
+        reason = None
+        if broken:
+            reason = "執行錯誤"
+        elif session.use_count >= self.max_uses:
+            reason = f"已使用 {session.use_count} 次"
+        else:
+            rss = session.rss_mb()
+            if rss is not None and rss > self.max_rss_mb:
+                reason = f"記憶體 {rss:.0f}MB 超過上限"
+
+        if reason:
+            self._discard(session, reason)
+            self.warm_in_background()
+        else:
+            self._idle.put(session)
+
+    def _discard(self, session, reason: str):
+        safe_print(f"回收 Chrome session：{reason}", "INFO")
+        session.quit()
+        with self._lock:
+            self._total -= 1
+            self.stats['recycled'] += 1
+
+        import gc
+        gc.collect()
+
+    @contextmanager
+    def lease(self, timeout: float = None):
+        """借出一個 Chrome session，使用完畢自動歸還或回收"""
+        session = self._acquire(timeout if timeout is not None else CHROME_POOL_LEASE_TIMEOUT)
+        broken = False
+        try:
+            yield session
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(session, broken)
+
+    def warm(self):
+        """補足連線池到設定大小（冷啟動成本只在這裡支付）"""
+        while self._reserve_slot():
+            try:
+                self._idle.put(self._build_session())
+            except Exception as e:
+                safe_print(f"預先建立 Chrome session 失敗: {e}", "ERROR")
+                break
+
+    def warm_in_background(self):
+        threading.Thread(target=self.warm, daemon=True).start()
+
+    def shutdown(self):
+        """關閉所有閒置中的 session"""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(session, "連線池關閉")
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'size': self.size,
+                'alive': self._total,
+                'idle': self._idle.qsize(),
+                'max_uses': self.max_uses,
+                'max_rss_mb': self.max_rss_mb,
+                **self.stats,
+            }
+
+
+chrome_pool = ChromeSessionPool(CHROME_POOL_SIZE, CHROME_POOL_MAX_USES, CHROME_POOL_MAX_RSS_MB)
+
+
+def wait_for_phase(driver, phase: str, timeout: float, condition):
+    """等待頁面達到指定狀態（有上限），並記錄實際耗時"""
+    start_time = time.time()
+    try:
+        result = WebDriverWait(driver, timeout, poll_frequency=0.2).until(condition)
+    except Exception:
+        safe_print(f"[等待] {phase} 超過上限 {timeout:.0f} 秒", "WARNING")
+        raise
+    safe_print(f"[等待] {phase} 就緒，耗時 {time.time() - start_time:.2f} 秒", "DEBUG")
+    return result
+
+
+# 在頁面內取出結果表格的每一列（儲存格文字處理方式與 BeautifulSoup get_text(strip=True) 相同），
+# 並附上列數 + 內容 hash 作為變化判斷用的 token
+EXTRACT_TABLE_SCRIPT = """
+const table = document.querySelector(arguments[0]);
+const ready = document.readyState === 'complete';
+if (!table) {
+    return {ready: ready, found: false, rows: [], token: null};
+}
+const cellText = (cell) => {
+    const walker = document.createTreeWalker(cell, NodeFilter.SHOW_TEXT);
+    let text = '';
+    while (walker.nextNode()) {
+        text += walker.currentNode.nodeValue.trim();
+    }
+    return text;
+};
+const rows = Array.from(table.querySelectorAll('tr')).slice(1).map(
+    (row) => Array.from(row.querySelectorAll('td')).map(cellText)
+);
+let hash = 0;
+const flat = JSON.stringify(rows);
+for (let i = 0; i < flat.length; i++) {
+    hash = (hash * 31 + flat.charCodeAt(i)) | 0;
+}
+return {ready: ready, found: true, rows: rows, token: rows.length + ':' + hash};
+"""
+
+
+def extract_attendance_table(driver) -> dict:
+    """以一次 execute_script 取回結果表格的列資料與變化 token"""
+    return driver.execute_script(EXTRACT_TABLE_SCRIPT, FUTAI_RESULT_TABLE_CSS)
+
+
+def find_result_table(driver):
+    """取得目前頁面上的出勤結果表格，沒有時返回 None"""
+    tables = driver.find_elements(By.CSS_SELECTOR, FUTAI_RESULT_TABLE_CSS)
+    return tables[0] if tables else None
+
+
+def get_result_table_token(driver):
+    """點擊查詢前記錄目前結果表格的 token（沒有表格時為 None）"""
+    return extract_attendance_table(driver)['token']
+
+
+def wait_for_result_table(driver, old_table, old_token=None):
+    """等待查詢結果表格出現，或舊表格被新結果取代（表格被替換或 token 改變），返回擷取結果"""
+    def result_ready(d):
+        replaced = old_table is None
+        if not replaced:
+            try:
+                old_table.is_enabled()
+            except StaleElementReferenceException:
+                replaced = True
+
+        snapshot = extract_attendance_table(d)
+        if not snapshot['ready'] or not snapshot['found']:
+            return False
+        if replaced or (old_token is not None and snapshot['token'] != old_token):
+            return snapshot
+        return False
+
+    return wait_for_phase(driver, "查詢結果表格", FUTAI_WAIT_RESULT, result_ready)
+
+
 def click_query_button_improved(driver, wait):
     """改進的查詢按鈕點擊方法"""
     safe_print("尋找並點擊查詢按鈕...", "DEBUG")
@@ -528,11 +1349,9 @@ def click_query_button_improved(driver, wait):
         )
 
         driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", query_button)
-        time.sleep(1)
 
-        pre_click_html = driver.page_source
-        pre_click_hash = hash(pre_click_html)
-        safe_print(f"點擊前頁面 hash: {pre_click_hash}", "DEBUG")
+        old_table = find_result_table(driver)
+        old_token = get_result_table_token(driver)
 
         click_success = False
 
@@ -564,31 +1383,14 @@ def click_query_button_improved(driver, wait):
 
         safe_print("等待查詢結果載入...", "DEBUG")
 
-        max_wait_time = 15
-        start_time = time.time()
-
-        while time.time() - start_time < max_wait_time:
-            time.sleep(1)
-            current_html = driver.page_source
-            current_hash = hash(current_html)
-
-            if current_hash != pre_click_hash:
-                safe_print(f"檢測到頁面內容變化 (等待了 {time.time() - start_time:.1f} 秒)", "DEBUG")
-                break
-
-            safe_print(f"等待中... ({time.time() - start_time:.1f}s)", "DEBUG")
-        else:
-            safe_print("警告: 超時未檢測到頁面變化", "WARNING")
+        wait_for_result_table(driver, old_table, old_token)
 
         try:
-            WebDriverWait(driver, 5).until_not(
-                EC.presence_of_element_located((By.CLASS_NAME, "loading"))
-            )
-            safe_print("載入指標已消失", "DEBUG")
-        except:
-            safe_print("沒有找到載入指標，繼續執行", "DEBUG")
+            wait_for_phase(driver, "載入指標消失", 5,
+                           EC.invisibility_of_element_located((By.CLASS_NAME, "loading")))
+        except Exception:
+            safe_print("載入指標未消失，繼續執行", "DEBUG")
 
-        time.sleep(3)
         safe_print("查詢完成，準備抓取結果", "DEBUG")
 
         return True
@@ -603,7 +1405,11 @@ def verify_query_result(driver, expected_date):
     safe_print(f"驗證查詢結果是否包含日期: {expected_date}", "DEBUG")
 
     try:
-        html_content = driver.page_source
+        if FUTAI_EXTRACT_MODE == 'script':
+            snapshot = extract_attendance_table(driver)
+            html_content = "\n".join(" ".join(row) for row in snapshot['rows'])
+        else:
+            html_content = driver.page_source
 
         today = datetime.datetime.strptime(expected_date, '%Y/%m/%d')
         date_formats = [
@@ -654,8 +1460,6 @@ def improved_query_process(driver, wait, today_str):
                 "document.getElementById('FindEDate').dispatchEvent(new Event('change', {bubbles: true}));"
             )
 
-            time.sleep(1)
-
             updated_start = driver.find_element(By.ID, 'FindDate').get_attribute('value')
             updated_end = driver.find_element(By.ID, 'FindEDate').get_attribute('value')
             safe_print(f"設定後的日期值 - 開始: {updated_start}, 結束: {updated_end}", "DEBUG")
@@ -693,173 +1497,1774 @@ def improved_query_process(driver, wait, today_str):
     return False
 
 
-def get_futai_attendance():
-    """抓取富台出勤資料（修正版本）"""
-    driver = None
-    try:
-        safe_print(f"開始抓取出勤資料...", "INFO")
+# ============== 🆕 登入 cookies 保存（跳過登入步驟） ==============
 
-        options = get_chrome_options()
-        driver = webdriver.Chrome(options=options)
-        wait = WebDriverWait(driver, 10)
+def get_cookie_fernet():
+    """取得加密 cookies 檔案用的 Fernet"""
+    if FUTAI_COOKIE_KEY:
+        return Fernet(FUTAI_COOKIE_KEY.encode())
+    seed = f"{FUTAI_USERNAME}:{FUTAI_PASSWORD}:{CHANNEL_SECRET}".encode()
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(seed).digest()))
 
-        driver.get('https://eportal.futai.com.tw/Home/Login?ReturnUrl=%2F')
 
-        id_field = wait.until(EC.presence_of_element_located((By.ID, 'Account')))
-        id_field.send_keys(FUTAI_USERNAME)
+class FutaiCookieJar:
+    """保存 eportal / bpmflow 登入後的 cookies（加密存檔），並追蹤到期時間"""
 
-        pwd_field = driver.find_element(By.ID, 'Pwd')
-        pwd_field.send_keys(FUTAI_PASSWORD)
-        pwd_field.submit()
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fernet = get_cookie_fernet()
+        self.cookies = []
+        self.saved_at = None
+        self.stats = {'saves': 0, 'restores': 0}
+        self._load()
 
-        time.sleep(3)
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                payload = json.loads(self._fernet.decrypt(f.read()))
+            self.cookies = payload.get('cookies', [])
+            self.saved_at = payload.get('saved_at')
+            safe_print(f"已載入 {len(self.cookies)} 個富台登入 cookies", "INFO")
+        except (InvalidToken, ValueError, OSError) as e:
+            safe_print(f"讀取登入 cookies 失敗，將重新登入: {e}", "WARNING")
+            self.cookies = []
+
+    def save(self, cookies: list):
+        """只保存富台網域的 cookies，寫入暫存檔後再取代，避免檔案寫到一半"""
+        cookies = [
+            cookie for cookie in cookies
+            if any(domain in (cookie.get('domain') or '') for domain in FUTAI_COOKIE_DOMAINS)
+        ]
+        if not cookies:
+            return
 
-        driver.get(
-            'https://bpmflow.futai.com.tw/futaibpmflow/SignOnFutai.aspx?Account=2993&Token=QxY%2BV82RudxNLWk6ZPWQdiDWxUmcDvnLTJUKvhMIG08%3D&FunctionID=AB-ABS-04')
+        with self._lock:
+            self.cookies = cookies
+            self.saved_at = time.time()
+            data = self._fernet.encrypt(json.dumps({'cookies': cookies, 'saved_at': self.saved_at}).encode())
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, self.path)
+                self.stats['saves'] += 1
+            except OSError as e:
+                safe_print(f"寫入登入 cookies 失敗: {e}", "WARNING")
+
+        safe_print(f"已保存 {len(cookies)} 個富台登入 cookies", "DEBUG")
+
+    def valid_cookies(self) -> list:
+        """返回尚未到期的 cookies，session cookie 超過 FUTAI_COOKIE_MAX_AGE 視為到期"""
+        now = time.time()
+        with self._lock:
+            if self.saved_at is None:
+                return []
+            session_expired = now - self.saved_at > FUTAI_COOKIE_MAX_AGE
+            return [
+                cookie for cookie in self.cookies
+                if (cookie.get('expires') is None and not session_expired)
+                or (cookie.get('expires') is not None and cookie['expires'] > now)
+            ]
 
-        time.sleep(3)
+    def clear(self):
+        with self._lock:
+            self.cookies = []
+            self.saved_at = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        safe_print("已清除富台登入 cookies", "INFO")
 
-        now = get_taiwan_now()
-        today_str = f"{now.year}/{now.month}/{now.day}"
+    def inject_into_driver(self, driver) -> bool:
+        """以 DevTools Network.setCookies 放入 cookies（不需先開啟該網域頁面）"""
+        cookies = self.valid_cookies()
+        if not cookies:
+            return False
 
-        driver.execute_script(f"document.getElementById('FindDate').value = '{today_str}';")
-        driver.execute_script(f"document.getElementById('FindEDate').value = '{today_str}';")
+        params = []
+        for cookie in cookies:
+            param = {
+                'name': cookie['name'],
+                'value': cookie['value'],
+                'domain': cookie['domain'],
+                'path': cookie.get('path') or '/',
+                'secure': bool(cookie.get('secure')),
+                'httpOnly': bool(cookie.get('httpOnly')),
+            }
+            if cookie.get('expires') is not None:
+                param['expires'] = cookie['expires']
+            params.append(param)
 
-        time.sleep(1)
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+        self.stats['restores'] += 1
+        safe_print(f"[selenium] 已放入 {len(params)} 個保存的登入 cookies", "DEBUG")
+        return True
 
-        query_button = driver.find_element(By.XPATH, "//input[@name='Submit' and @value='查詢']")
-        driver.execute_script("arguments[0].click();", query_button)
+    def save_from_driver(self, driver):
+        """從 Chrome 取出所有網域的 cookies 並保存"""
+        try:
+            cookies = driver.execute_cdp_cmd('Network.getAllCookies', {}).get('cookies', [])
+        except Exception as e:
+            safe_print(f"取得 Chrome cookies 失敗: {e}", "WARNING")
+            return
 
-        time.sleep(5)
+        self.save([
+            {
+                'name': cookie['name'],
+                'value': cookie['value'],
+                'domain': cookie['domain'],
+                'path': cookie.get('path', '/'),
+                'expires': None if cookie.get('session') or cookie.get('expires', -1) < 0 else cookie['expires'],
+                'secure': cookie.get('secure', False),
+                'httpOnly': cookie.get('httpOnly', False),
+            }
+            for cookie in cookies
+        ])
+
+    def inject_into_session(self, http_session) -> bool:
+        """放入 requests.Session 的 cookie jar"""
+        cookies = self.valid_cookies()
+        for cookie in cookies:
+            http_session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie['domain'], path=cookie.get('path') or '/',
+                secure=bool(cookie.get('secure')),
+                expires=int(cookie['expires']) if cookie.get('expires') is not None else None
+            )
+        if cookies:
+            self.stats['restores'] += 1
+            safe_print(f"[http] 已放入 {len(cookies)} 個保存的登入 cookies", "DEBUG")
+        return bool(cookies)
+
+    def save_from_session(self, http_session):
+        self.save([
+            {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'expires': cookie.expires,
+                'secure': cookie.secure,
+                'httpOnly': cookie.has_nonstandard_attr('HttpOnly'),
+            }
+            for cookie in http_session.cookies
+        ])
 
-        html_content = driver.page_source
-        return parse_attendance_html(html_content)
+    def get_status(self) -> dict:
+        cookies = self.valid_cookies()
+        expiries = [cookie['expires'] for cookie in cookies if cookie.get('expires') is not None]
+        return {
+            'valid_cookies': len(cookies),
+            'saved_at': datetime.datetime.fromtimestamp(self.saved_at, TAIWAN_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            if self.saved_at else None,
+            'earliest_expiry': datetime.datetime.fromtimestamp(min(expiries), TAIWAN_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            if expiries else None,
+            **self.stats,
+        }
 
-    except Exception as e:
-        safe_print(f"抓取出勤資料發生錯誤: {e}", "ERROR")
-        return None
-    finally:
-        if driver:
-            try:
-                driver.quit()
-                time.sleep(2)
-                import gc
-                gc.collect()
-            except:
-                pass
 
+futai_cookie_jar = FutaiCookieJar(FUTAI_COOKIE_FILE)
 
-def parse_attendance_html(html_content):
-    """解析出勤 HTML 資料（更新版本）"""
-    try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        table = soup.find('table', {'width': '566', 'border': '1'})
 
-        if not table:
-            safe_print("找不到出勤資料表格", "WARNING")
-            return None
+def futai_login(driver, wait):
+    """登入富台 eportal"""
+    with scrape_stages.stage('login'):
+        _futai_login(driver, wait)
 
-        attendance_data = {}
-        rows = table.find_all('tr')[1:]
 
-        for row in rows:
-            cells = row.find_all('td')
-            if len(cells) < 5:
-                continue
+def _futai_login(driver, wait):
+    driver.get(FUTAI_LOGIN_URL)
 
-            try:
-                employee_id = cells[0].get_text(strip=True)
-                employee_name = cells[1].get_text(strip=True)
-                raw_date = cells[2].get_text(strip=True)
+    id_field = wait.until(EC.presence_of_element_located((By.ID, 'Account')))
+    id_field.send_keys(FUTAI_USERNAME)
 
-                try:
-                    if '/' in raw_date:
-                        parts = raw_date.split('/')
-                        if len(parts) == 3:
-                            year, month, day = parts
-                            date = f"{year}/{int(month)}/{int(day)}"
-                        else:
-                            date = raw_date
-                    else:
-                        date = raw_date
+    pwd_field = driver.find_element(By.ID, 'Pwd')
+    pwd_field.send_keys(FUTAI_PASSWORD)
+    cookies_before = {cookie['name'] for cookie in driver.get_cookies()}
+    pwd_field.submit()
 
-                    safe_print(f"日期解析 - 原始: {raw_date}, 處理後: {date}", "DEBUG")
+    def login_done(d):
+        if '/Home/Login' not in d.current_url:
+            return True
+        return bool({cookie['name'] for cookie in d.get_cookies()} - cookies_before)
 
-                except Exception as date_error:
-                    date = raw_date
-                    safe_print(f"日期解析失敗: {date_error}", "WARNING")
+    wait_for_phase(driver, "登入", FUTAI_WAIT_LOGIN, login_done)
+    page_metrics.record(driver, 'login')
 
-                times = []
-                for i in range(3, len(cells)):
-                    cell_text = cells[i].get_text(strip=True)
-                    if re.match(r'\d{2}:\d{2}', cell_text):
-                        times.append(cell_text)
-                    elif cell_text == '':
-                        continue
-                    else:
-                        break
 
-                if times:
-                    earliest_time = min(times)
-                    work_start = datetime.datetime.strptime(earliest_time, '%H:%M')
-                    work_end = work_start + timedelta(hours=9)
-                    work_end_str = work_end.strftime('%H:%M')
+def open_futai_query_page(driver):
+    """開啟 AB-ABS-04 出勤查詢頁面，返回是否仍保持登入"""
+    def page_ready(d):
+        return '/Home/Login' in d.current_url or bool(d.find_elements(By.ID, 'FindDate'))
 
-                    attendance_data[employee_id] = {
-                        'name': employee_name,
-                        'date': date,
-                        'times': times,
-                        'work_start': earliest_time,
-                        'work_end': work_end_str
-                    }
+    with scrape_stages.stage('navigation'):
+        driver.get(FUTAI_SIGNON_URL)
+        wait_for_phase(driver, "查詢頁面 FindDate", FUTAI_WAIT_QUERY_PAGE, page_ready)
+    page_metrics.record(driver, 'query_page')
 
-            except Exception as e:
-                safe_print(f"解析某一列資料時發生錯誤: {e}", "ERROR")
-                continue
+    return '/Home/Login' not in driver.current_url
 
-        safe_print(f"解析完成，找到 {len(attendance_data)} 筆出勤資料", "INFO")
-        return attendance_data
 
-    except Exception as e:
-        safe_print(f"解析 HTML 時發生錯誤: {e}", "ERROR")
-        return None
+def query_attendance_rows_selenium(start_str: str, end_str: str):
+    """以 Chrome 連線池查詢指定日期區間，返回結果表格的列資料"""
+    with chrome_pool.lease() as session:
+        driver = session.driver
+        wait = WebDriverWait(driver, 10)
 
+        # 有保存的 cookies 時直接前往查詢頁面，被導回 /Home/Login 才登入
+        if not session.logged_in:
+            session.logged_in = futai_cookie_jar.inject_into_driver(driver)
+            if not session.logged_in:
+                futai_login(driver, wait)
+                session.logged_in = True
 
-def send_daily_attendance_for_husband():
-    """發送每日出勤資料給老公（詳細版本，包含下班提醒設定）"""
-    safe_print(f"開始執行老公的出勤資料查詢...", "INFO")
+        if open_futai_query_page(driver):
+            if futai_cookie_jar.saved_at is None:
+                futai_cookie_jar.save_from_driver(driver)
+        else:
+            safe_print("登入狀態已失效，重新登入", "INFO")
+            futai_login(driver, wait)
+            if not open_futai_query_page(driver):
+                session.logged_in = False
+                raise Exception("重新登入後仍無法開啟查詢頁面")
+            futai_cookie_jar.save_from_driver(driver)
 
-    try:
-        attendance_data = get_futai_attendance()
+        with scrape_stages.stage('query'):
+            driver.execute_script(f"document.getElementById('FindDate').value = '{start_str}';")
+            driver.execute_script(f"document.getElementById('FindEDate').value = '{end_str}';")
 
-        if attendance_data:
-            user_attendance = attendance_data.get(FUTAI_USERNAME)
+            old_table = find_result_table(driver)
+            old_token = get_result_table_token(driver)
+            query_button = driver.find_element(By.XPATH, "//input[@name='Submit' and @value='查詢']")
+            driver.execute_script("arguments[0].click();", query_button)
 
-            if user_attendance:
-                work_end_str = user_attendance['work_end']
-                work_manager.set_work_end_time(work_end_str)
-                work_manager.setup_work_end_reminders(work_end_str)
+            snapshot = wait_for_result_table(driver, old_table, old_token)
+        page_metrics.record(driver, 'result')
 
-                message = f"""📋 今日出勤資料 ({user_attendance['date']})
+        if FUTAI_EXTRACT_MODE == 'script':
+            return snapshot['rows']
 
-👤 {user_attendance['name']} ({FUTAI_USERNAME})
-🕐 上班：{user_attendance['work_start']}
-🕕 預估下班：{user_attendance['work_end']}
+        html_content = driver.page_source
 
-💡 所有刷卡時間：{', '.join(user_attendance['times'])}
-⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}
+    return extract_attendance_rows(html_content)
 
-🔔 已設定下班前提醒：1小時、30分鐘、10分鐘、5分鐘"""
 
-            else:
-                message = f"""⚠️ 未找到今日出勤資料
+def get_futai_attendance_selenium():
+    """抓取富台出勤資料（使用 Chrome 連線池，不再每次啟動瀏覽器）"""
+    try:
+        safe_print(f"[selenium] 開始抓取出勤資料...", "INFO")
 
-可能原因：
-• 今天尚未刷卡上班
-• 系統資料尚未更新
-• 網路連線問題
+        today_str = format_futai_date(get_taiwan_today())
+        rows = query_attendance_rows_selenium(today_str, today_str)
+        if rows is None:
+            return None
+        with scrape_stages.stage('parse'):
+            return parse_attendance_rows(rows, log_rows=False)
 
-⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+    except Exception as e:
+        safe_print(f"抓取出勤資料發生錯誤: {e}", "ERROR")
+        return None
+
+
+# ============== 🆕 HTTP 出勤查詢後端（不啟動瀏覽器） ==============
+
+def collect_form_fields(form) -> dict:
+    """收集表單中會被送出的欄位（含 ASP.NET 的 __VIEWSTATE、__EVENTVALIDATION 等隱藏欄位）"""
+    fields = {}
+
+    for field in form.find_all('input'):
+        name = field.get('name')
+        if not name:
+            continue
+
+        field_type = (field.get('type') or 'text').lower()
+        if field_type in ('submit', 'button', 'image', 'reset', 'file'):
+            continue
+        if field_type in ('checkbox', 'radio') and not field.has_attr('checked'):
+            continue
+
+        fields[name] = field.get('value', '')
+
+    for select in form.find_all('select'):
+        name = select.get('name')
+        if not name:
+            continue
+        option = select.find('option', selected=True) or select.find('option')
+        if option is not None:
+            fields[name] = option.get('value', option.get_text(strip=True))
+
+    for textarea in form.find_all('textarea'):
+        name = textarea.get('name')
+        if name:
+            fields[name] = textarea.get_text()
+
+    return fields
+
+
+class FutaiHttpClient:
+    """以 requests.Session 重播富台登入與查詢流程"""
+
+    def __init__(self, username: str = None, password: str = None, cookie_jar=None):
+        self.username = username or FUTAI_USERNAME
+        self.password = password or FUTAI_PASSWORD
+        self.cookie_jar = cookie_jar
+        self.session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                      allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+            'Accept-Language': 'zh-TW,zh;q=0.9',
+        })
+        # requests.Session 不保證執行緒安全，同一時間只跑一個流程
+        self._lock = threading.Lock()
+        self._cookies_restored = False
+
+    def login(self):
+        """送出 eportal 登入表單"""
+        with scrape_stages.stage('login'):
+            self._login()
+
+    def _login(self):
+        response = self.session.get(FUTAI_LOGIN_URL, timeout=FUTAI_HTTP_TIMEOUT)
+        response.raise_for_status()
+
+        soup = BeautifulSoup(response.text, 'html.parser')
+        account_field = soup.find('input', {'id': 'Account'})
+        form = account_field.find_parent('form') if account_field else None
+        if form is None:
+            raise Exception("找不到登入表單")
+
+        fields = collect_form_fields(form)
+        fields[account_field.get('name') or 'Account'] = self.username
+        pwd_field = form.find('input', {'id': 'Pwd'})
+        fields[(pwd_field.get('name') if pwd_field else None) or 'Pwd'] = self.password
+
+        action_url = urljoin(response.url, form.get('action') or response.url)
+        response = self.session.post(action_url, data=fields, timeout=FUTAI_HTTP_TIMEOUT)
+        response.raise_for_status()
+
+        if '/Home/Login' in response.url:
+            raise Exception("登入失敗，仍停留在登入頁面")
+
+    def open_query_page(self):
+        """開啟 SignOn 轉址後的查詢頁面，未登入時返回 None"""
+        with scrape_stages.stage('navigation'):
+            response = self.session.get(FUTAI_SIGNON_URL, timeout=FUTAI_HTTP_TIMEOUT)
+        response.raise_for_status()
+
+        if '/Home/Login' in response.url or 'FindDate' not in response.text:
+            return None
+        return response
+
+    def _ensure_query_page(self):
+        """開啟查詢頁面，登入失效時重新登入並保存 cookies"""
+        if self.cookie_jar is not None and not self._cookies_restored:
+            self.cookie_jar.inject_into_session(self.session)
+            self._cookies_restored = True
+
+        page = self.open_query_page()
+        if page is None:
+            safe_print("[http] 尚未登入或登入已失效，執行登入", "DEBUG")
+            self.login()
+            page = self.open_query_page()
+            if page is None:
+                raise Exception("登入後仍無法開啟查詢頁面")
+            if self.cookie_jar is not None:
+                self.cookie_jar.save_from_session(self.session)
+        return page
+
+    def warm(self):
+        """🆕 預先開啟查詢頁面（必要時登入），之後的查詢可直接沿用連線與登入狀態"""
+        with self._lock:
+            self._ensure_query_page()
+
+    def close(self):
+        """🆕 關閉保持中的連線（cookies 保留，下次查詢時重新建立連線）"""
+        with self._lock:
+            self.session.close()
+
+    def query(self, start_str: str, end_str: str) -> str:
+        """查詢指定日期區間，返回結果頁 HTML"""
+        with self._lock:
+            page = self._ensure_query_page()
+
+            soup = BeautifulSoup(page.text, 'html.parser')
+            date_field = soup.find('input', {'id': 'FindDate'})
+            form = date_field.find_parent('form') if date_field else None
+            if form is None:
+                raise Exception("找不到查詢表單")
+
+            fields = collect_form_fields(form)
+            fields['FindDate'] = start_str
+            fields['FindEDate'] = end_str
+            fields['Submit'] = '查詢'
+
+            action_url = urljoin(page.url, form.get('action') or page.url)
+            with scrape_stages.stage('query'):
+                response = self.session.post(action_url, data=fields, timeout=FUTAI_HTTP_TIMEOUT,
+                                             headers={'Referer': page.url})
+            response.raise_for_status()
+            return response.text
+
+
+futai_http_client = FutaiHttpClient(cookie_jar=futai_cookie_jar)
+
+
+def get_futai_attendance_http():
+    """以 HTTP 直接查詢富台出勤資料（不啟動 Chrome）"""
+    try:
+        safe_print(f"[http] 開始抓取出勤資料...", "INFO")
+
+        today_str = format_futai_date(get_taiwan_today())
+
+        html_content = futai_http_client.query(today_str, today_str)
+        with scrape_stages.stage('parse'):
+            rows = extract_attendance_rows(html_content)
+            # 沒有表格或表格是空的，可能是 postback 沒有真的送出查詢，不能當成「尚未刷卡」，交給 selenium 確認
+            if not rows:
+                safe_print("[http] 查詢結果沒有出勤資料列，視為查詢失敗", "WARNING")
+                return None
+            return parse_attendance_rows(rows, log_rows=False)
+
+    except Exception as e:
+        safe_print(f"[http] 抓取出勤資料發生錯誤: {e}", "ERROR")
+        return None
+
+
+def diff_attendance_results(primary, secondary) -> list:
+    """比較兩個後端解析出的出勤資料，返回差異說明"""
+    if primary is None or secondary is None:
+        if primary is secondary:
+            return []
+        return [f"其中一方查詢失敗 (http={primary is not None}, selenium={secondary is not None})"]
+
+    differences = []
+    for employee_id in sorted(set(primary) | set(secondary)):
+        left = primary.get(employee_id)
+        right = secondary.get(employee_id)
+        if left != right:
+            differences.append(f"{employee_id}: http={left} selenium={right}")
+    return differences
+
+
+shadow_stats = {'runs': 0, 'mismatches': 0, 'last_mismatch': None}
+
+
+def get_futai_attendance():
+    """依 ATTENDANCE_BACKEND 選擇出勤查詢後端"""
+    if ATTENDANCE_BACKEND == 'selenium':
+        return get_futai_attendance_selenium()
+
+    start_time = time.time()
+    http_result = get_futai_attendance_http()
+    http_elapsed = time.time() - start_time
+
+    if ATTENDANCE_BACKEND == 'shadow':
+        start_time = time.time()
+        selenium_result = get_futai_attendance_selenium()
+        selenium_elapsed = time.time() - start_time
+
+        differences = diff_attendance_results(http_result, selenium_result)
+        shadow_stats['runs'] += 1
+        safe_print(f"[shadow] http 耗時 {http_elapsed * 1000:.0f}ms，"
+                   f"selenium 耗時 {selenium_elapsed * 1000:.0f}ms", "INFO")
+        if differences:
+            shadow_stats['mismatches'] += 1
+            shadow_stats['last_mismatch'] = get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')
+            for difference in differences:
+                safe_print(f"[shadow] 結果不一致 - {difference}", "WARNING")
+        else:
+            safe_print("[shadow] 兩個後端結果一致", "INFO")
+
+        # 影子模式以 selenium 結果為準
+        return selenium_result
+
+    if http_result is not None:
+        safe_print(f"[http] 查詢完成，耗時 {http_elapsed * 1000:.0f}ms", "INFO")
+        return http_result
+
+    safe_print("[http] 查詢失敗，改用 selenium 備援", "WARNING")
+    return get_futai_attendance_selenium()
+
+
+# ============== 🆕 多帳號出勤查詢（共用一個 Chrome） ==============
+
+def get_futai_accounts() -> list:
+    """主帳號 + FUTAI_ACCOUNTS 中設定的其他帳號"""
+    accounts = [{'username': FUTAI_USERNAME, 'password': FUTAI_PASSWORD, 'label': '灰鵝', 'subscribers': []}]
+    for account in FUTAI_EXTRA_ACCOUNTS:
+        if not account.get('username') or not account.get('password'):
+            safe_print("FUTAI_ACCOUNTS 中有缺少 username／password 的帳號，已略過", "WARNING")
+            continue
+        if account['username'] == FUTAI_USERNAME:
+            continue
+        accounts.append({'label': account['username'], 'subscribers': [], **account})
+    return accounts
+
+
+futai_account_clients = {}
+futai_account_clients_lock = threading.Lock()
+
+
+def get_futai_http_client(account: dict) -> FutaiHttpClient:
+    """每個帳號使用自己的 requests.Session（登入 cookies 互不干擾），主帳號沿用 futai_http_client"""
+    if account['username'] == FUTAI_USERNAME:
+        return futai_http_client
+    with futai_account_clients_lock:
+        client = futai_account_clients.get(account['username'])
+        if client is None:
+            client = FutaiHttpClient(account['username'], account['password'])
+            futai_account_clients[account['username']] = client
+        return client
+
+
+def query_accounts_http(accounts, start_str: str, end_str: str) -> dict:
+    """以 HTTP 同時查詢多個帳號，返回 {帳號: 結果列資料（失敗為 None）}"""
+    def query_account(account):
+        try:
+            rows = extract_attendance_rows(get_futai_http_client(account).query(start_str, end_str))
+            # 與單一帳號查詢相同：空的結果不能確定是尚未刷卡，交給 selenium 重查
+            return rows or None
+        except Exception as e:
+            safe_print(f"[http] 帳號 {account['username']} 查詢失敗: {e}", "WARNING")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, FUTAI_ACCOUNT_PARALLELISM)) as pool:
+        results = pool.map(query_account, accounts)
+        return {account['username']: rows for account, rows in zip(accounts, results)}
+
+
+FILL_LOGIN_SCRIPT = """
+document.getElementById('Account').value = arguments[0];
+const pwd = document.getElementById('Pwd');
+pwd.value = arguments[1];
+pwd.form.submit();
+"""
+
+SUBMIT_QUERY_SCRIPT = """
+window.__futaiQuerySubmitted = true;
+document.getElementById('FindDate').value = arguments[0];
+document.getElementById('FindEDate').value = arguments[1];
+document.querySelector("input[name='Submit'][value='查詢']").click();
+"""
+
+
+# postback 完成：送出前設下的標記隨舊 document 消失（整頁 postback），或 __VIEWSTATE 已更新（部分 postback）
+POSTBACK_DONE_SCRIPT = """
+if (document.readyState !== 'complete') {
+    return false;
+}
+const viewState = document.getElementById('__VIEWSTATE');
+return window.__futaiQuerySubmitted !== true || (viewState !== null && viewState.value !== arguments[0]);
+"""
+
+VIEW_STATE_SCRIPT = """
+const viewState = document.getElementById('__VIEWSTATE');
+return viewState ? viewState.value : null;
+"""
+
+
+class FutaiAccountTab:
+    """共用 Chrome 中某個帳號的分頁：各自在獨立的 browser context（cookies 互不干擾），
+    以非阻塞的方式推進 登入 → 查詢頁 → 查詢結果，讓多個分頁的頁面載入同時進行"""
+
+    def __init__(self, driver, account: dict, start_str: str, end_str: str):
+        self.driver = driver
+        self.account = account
+        self.start_str = start_str
+        self.end_str = end_str
+        self.rows = None
+        self.error = None
+        self.old_view_state = None
+
+        handles_before = set(driver.window_handles)
+        self.context_id = driver.execute_cdp_cmd('Target.createBrowserContext', {})['browserContextId']
+        driver.execute_cdp_cmd('Target.createTarget', {'url': 'about:blank', 'browserContextId': self.context_id})
+        new_handles = set(driver.window_handles) - handles_before
+        if not new_handles:
+            raise Exception("無法建立新分頁")
+        self.handle = new_handles.pop()
+
+        driver.switch_to.window(self.handle)
+        apply_resource_blocking(driver)
+        self._navigate(FUTAI_LOGIN_URL, 'login_page', FUTAI_WAIT_LOGIN)
+
+    @property
+    def active(self) -> bool:
+        return self.state not in ('done', 'failed')
+
+    def _enter(self, state: str, timeout: float):
+        self.state = state
+        self.deadline = time.time() + timeout
+
+    def _navigate(self, url: str, state: str, timeout: float):
+        self.driver.execute_script("window.location.href = arguments[0];", url)
+        self._enter(state, timeout)
+
+    def step(self) -> bool:
+        """推進一步（呼叫前需先切換到本分頁），返回是否有進展"""
+        if time.time() > self.deadline:
+            self.error = f"{self.state} 逾時"
+            self.state = 'failed'
+            return True
+        try:
+            return self._advance()
+        except WebDriverException:
+            # 頁面切換中，下一輪再試
+            return False
+
+    def _advance(self) -> bool:
+        driver = self.driver
+
+        if self.state == 'login_page':
+            if not driver.find_elements(By.ID, 'Account'):
+                return False
+            driver.execute_script(FILL_LOGIN_SCRIPT, self.account['username'], self.account['password'])
+            self._enter('logging_in', FUTAI_WAIT_LOGIN)
+            return True
+
+        if self.state == 'logging_in':
+            if '/Home/Login' in driver.current_url:
+                return False
+            self._navigate(FUTAI_SIGNON_URL, 'query_page', FUTAI_WAIT_QUERY_PAGE)
+            return True
+
+        if self.state == 'query_page':
+            if '/Home/Login' in driver.current_url:
+                self.error = "登入後仍被導回登入頁面"
+                self.state = 'failed'
+                return True
+            if not driver.find_elements(By.ID, 'FindDate'):
+                return False
+            self.old_view_state = driver.execute_script(VIEW_STATE_SCRIPT)
+            driver.execute_script(SUBMIT_QUERY_SCRIPT, self.start_str, self.end_str)
+            self._enter('querying', FUTAI_WAIT_RESULT)
+            return True
+
+        if self.state == 'querying':
+            # 以 postback 本身判斷查詢完成；結果內容可能與上一個帳號相同（例如都還沒刷卡）
+            if not driver.execute_script(POSTBACK_DONE_SCRIPT, self.old_view_state):
+                return False
+            snapshot = extract_attendance_table(driver)
+            if not snapshot['ready']:
+                return False
+            if not snapshot['found']:
+                self.error = "查詢結果沒有出勤表格"
+                self.state = 'failed'
+                return True
+            self.rows = snapshot['rows']
+            self.state = 'done'
+            return True
+
+        return False
+
+    def close(self):
+        try:
+            self.driver.switch_to.window(self.handle)
+            self.driver.close()
+        except Exception:
+            pass
+        try:
+            self.driver.execute_cdp_cmd('Target.disposeBrowserContext', {'browserContextId': self.context_id})
+        except Exception:
+            pass
+
+
+def query_accounts_selenium(accounts, start_str: str, end_str: str) -> dict:
+    """在同一個 Chrome 中以分頁同時查詢多個帳號（最多 FUTAI_ACCOUNT_PARALLELISM 個分頁），
+    返回 {帳號: 結果列資料（失敗為 None）}"""
+    results = {}
+    pending = list(accounts)
+    tabs = []
+
+    with chrome_pool.lease() as session:
+        driver = session.driver
+        main_handle = driver.current_window_handle
+        try:
+            while pending or tabs:
+                while pending and len(tabs) < max(1, FUTAI_ACCOUNT_PARALLELISM):
+                    account = pending.pop(0)
+                    try:
+                        tabs.append(FutaiAccountTab(driver, account, start_str, end_str))
+                    except Exception as e:
+                        safe_print(f"[selenium] 帳號 {account['username']} 開啟分頁失敗: {e}", "WARNING")
+                        results[account['username']] = None
+
+                progressed = False
+                for tab in list(tabs):
+                    driver.switch_to.window(tab.handle)
+                    progressed = tab.step() or progressed
+                    if not tab.active:
+                        if tab.error:
+                            safe_print(f"[selenium] 帳號 {tab.account['username']} 查詢失敗: {tab.error}", "WARNING")
+                        results[tab.account['username']] = tab.rows
+                        tab.close()
+                        tabs.remove(tab)
+
+                if not progressed:
+                    time.sleep(0.2)
+        finally:
+            for tab in tabs:
+                tab.close()
+            driver.switch_to.window(main_handle)
+
+    return results
+
+
+def get_futai_attendance_accounts():
+    """查詢所有帳號今日出勤並合併成一份結果，返回 (員工編號 → 出勤資料, 查詢成功的帳號清單)；全部失敗時返回 None"""
+    accounts = get_futai_accounts()
+    today_str = format_futai_date(get_taiwan_today())
+    start_time = time.time()
+
+    rows_by_account = {}
+    if ATTENDANCE_BACKEND != 'selenium':
+        rows_by_account = query_accounts_http(accounts, today_str, today_str)
+
+    remaining = [account for account in accounts if rows_by_account.get(account['username']) is None]
+    if remaining:
+        try:
+            rows_by_account.update(query_accounts_selenium(remaining, today_str, today_str))
+        except Exception as e:
+            safe_print(f"[selenium] 多帳號查詢失敗: {e}", "ERROR")
+
+    succeeded = [username for username, rows in rows_by_account.items() if rows is not None]
+    if not succeeded:
+        return None
+
+    merged = {}
+    for username in succeeded:
+        merged.update(parse_attendance_rows(rows_by_account[username], log_rows=False) or {})
+
+    safe_print(f"多帳號查詢完成：{len(succeeded)}/{len(accounts)} 個帳號成功，"
+               f"共 {len(merged)} 筆出勤資料，耗時 {time.time() - start_time:.1f} 秒", "INFO")
+    return merged, succeeded
+
+
+class SingleFlight:
+    """合併同時進行的相同查詢：同一個 key 同時間只實際執行一次，其他呼叫者等待並共用結果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'executions': 0, 'shared': 0}
+
+    def do(self, key: str, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                self.stats['executions'] += 1
+                is_leader = True
+            else:
+                self.stats['shared'] += 1
+                is_leader = False
+
+        if not is_leader:
+            safe_print(f"查詢 {key} 已在進行中，等待共用結果", "DEBUG")
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+    def in_flight(self) -> list:
+        with self._lock:
+            return list(self._calls.keys())
+
+
+attendance_flight = SingleFlight()
+
+
+class AttendanceCache:
+    """以 (員工編號, 日期) 為 key 的出勤結果快取"""
+
+    def __init__(self, ttl: int, negative_ttl: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _expires_at(self, date_str: str, entry):
+        """過去日期的資料不會再變動，永久保存；今日資料依是否已刷卡給不同 TTL"""
+        try:
+            entry_date = datetime.datetime.strptime(date_str, '%Y/%m/%d').date()
+            if entry_date < get_taiwan_today():
+                return None
+        except ValueError:
+            pass
+
+        ttl = self.ttl if entry else self.negative_ttl
+        return time.time() + ttl
+
+    def get(self, employee_id: str, date_str: str):
+        """返回 (是否命中, 出勤資料)；出勤資料為 None 代表已確認查無資料"""
+        key = (employee_id, date_str)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                expires_at = cached['expires_at']
+                if expires_at is None or expires_at > time.time():
+                    self.stats['hits'] += 1
+                    return True, cached['entry']
+                del self._entries[key]
+
+            self.stats['misses'] += 1
+            return False, None
+
+    def put(self, employee_id: str, date_str: str, entry):
+        with self._lock:
+            self._entries[(employee_id, date_str)] = {
+                'entry': entry,
+                'expires_at': self._expires_at(date_str, entry),
+            }
+
+    def put_snapshot(self, date_str: str, attendance_data: dict, expected_ids=()):
+        """存入一次查詢的所有員工資料；expected_ids 中查無資料者記為未刷卡"""
+        for employee_id, entry in attendance_data.items():
+            self.put(employee_id, entry.get('date', date_str), entry)
+
+        for employee_id in expected_ids:
+            if employee_id not in attendance_data:
+                self.put(employee_id, date_str, None)
+
+    def invalidate(self, employee_id: str = None, date_str: str = None) -> int:
+        """清除符合條件的快取（不帶參數時全部清除），返回清除筆數"""
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (employee_id is None or key[0] == employee_id)
+                and (date_str is None or key[1] == date_str)
+            ]
+            for key in keys:
+                del self._entries[key]
+            self.stats['invalidations'] += len(keys)
+
+        if keys:
+            safe_print(f"已清除 {len(keys)} 筆出勤快取", "DEBUG")
+        return len(keys)
+
+    def clear_expired(self):
+        """清除已過期的快取"""
+        current_time = time.time()
+        with self._lock:
+            old_count = len(self._entries)
+            self._entries = {
+                key: cached for key, cached in self._entries.items()
+                if cached['expires_at'] is None or cached['expires_at'] > current_time
+            }
+            new_count = len(self._entries)
+        safe_print(f"清除過期出勤快取: {old_count} -> {new_count}", "INFO")
+
+    def get_status(self) -> dict:
+        with self._lock:
+            total = self.stats['hits'] + self.stats['misses']
+            return {
+                'entries': len(self._entries),
+                'hit_rate': round(self.stats['hits'] / total, 3) if total else 0,
+                **self.stats,
+            }
+
+
+attendance_cache = AttendanceCache(ATTENDANCE_CACHE_TTL, ATTENDANCE_CACHE_NEGATIVE_TTL)
+
+
+def fetch_futai_attendance(employee_id: str = None, force_refresh: bool = False):
+    """取得今日出勤資料：先查快取，未命中時抓取（同時間的多個查詢只會實際抓取一次）"""
+    employee_id = employee_id or FUTAI_USERNAME
+    today_str = format_futai_date(get_taiwan_today())
+
+    if not force_refresh:
+        hit, entry = attendance_cache.get(employee_id, today_str)
+        if hit:
+            safe_print(f"出勤快取命中: {employee_id} {today_str}", "DEBUG")
+            return {employee_id: entry} if entry else {}
+
+        # 重啟後快取是空的：資料庫中今天的紀錄仍在快取 TTL 內、或已有下班刷卡時直接使用，否則重新抓取
+        try:
+            stored, age = attendance_store.get_record_age(employee_id, get_taiwan_today())
+        except Exception as e:
+            safe_print(f"讀取出勤資料庫失敗: {e}", "WARNING")
+            stored, age = None, None
+        if stored and (age <= ATTENDANCE_CACHE_TTL
+                       or find_clock_out_punch(stored['work_start'], stored['times'])):
+            safe_print(f"出勤資料庫命中: {employee_id} {today_str}（{age:.0f} 秒前寫入）", "DEBUG")
+            return {employee_id: {key: value for key, value in stored.items() if key != 'employee_id'}}
+
+    attendance_data = attendance_flight.do(f"attendance:{today_str}", run_scrape_job, 'attendance')
+
+    if attendance_data is not None:
+        attendance_cache.put_snapshot(today_str, attendance_data, expected_ids=[employee_id])
+        try:
+            attendance_store.upsert_snapshot(attendance_data)
+        except Exception as e:
+            safe_print(f"寫入出勤資料庫失敗: {e}", "ERROR")
+
+    return attendance_data
+
+
+def fetch_futai_attendance_accounts():
+    """🆕 一次查詢所有帳號（共用一個 Chrome 或各自的 HTTP 連線），結果存入快取與資料庫"""
+    today_str = format_futai_date(get_taiwan_today())
+    result = attendance_flight.do(f"attendance_accounts:{today_str}", run_scrape_job, 'attendance_accounts')
+    if result is None:
+        return None
+
+    # 只有查詢成功的帳號才能記為「尚未刷卡」；查詢失敗的帳號留給下次重試
+    attendance_data, succeeded = result
+    attendance_cache.put_snapshot(today_str, attendance_data, expected_ids=succeeded)
+    try:
+        attendance_store.upsert_snapshot(attendance_data)
+    except Exception as e:
+        safe_print(f"寫入出勤資料庫失敗: {e}", "ERROR")
+
+    return attendance_data
+
+
+# ============== 🆕 出勤紀錄資料庫（SQLite） ==============
+
+class AttendanceStore:
+    """以 SQLite（WAL 模式）保存每位員工每天的出勤紀錄"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._init_schema()
+
+    def _connect(self):
+        """每個執行緒使用自己的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS attendance (
+                    employee_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    name TEXT,
+                    punches TEXT NOT NULL,
+                    work_start TEXT,
+                    work_end TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (employee_id, date)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)")
+
+    def upsert_records(self, records) -> int:
+        """批次寫入出勤紀錄（同一員工同一天以最新資料覆蓋），返回寫入筆數"""
+        updated_at = get_taiwan_now().isoformat()
+        params = []
+        for record in records:
+            try:
+                iso_date = futai_date_to_iso(record['date'])
+            except ValueError:
+                safe_print(f"略過無法辨識日期的出勤紀錄: {record['date']}", "WARNING")
+                continue
+            params.append((
+                record['employee_id'], iso_date, record['name'], json.dumps(record['times']),
+                record['work_start'], record['work_end'], updated_at
+            ))
+
+        if not params:
+            return 0
+
+        with self._write_lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("""
+                    INSERT INTO attendance (employee_id, date, name, punches, work_start, work_end, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (employee_id, date) DO UPDATE SET
+                        name = excluded.name,
+                        punches = excluded.punches,
+                        work_start = excluded.work_start,
+                        work_end = excluded.work_end,
+                        updated_at = excluded.updated_at
+                """, params)
+
+        safe_print(f"已寫入 {len(params)} 筆出勤紀錄", "DEBUG")
+        return len(params)
+
+    def upsert_snapshot(self, attendance_data: dict) -> int:
+        """寫入 parse_attendance_html() 格式的查詢結果"""
+        return self.upsert_records(
+            {'employee_id': employee_id, **entry} for employee_id, entry in attendance_data.items()
+        )
+
+    @staticmethod
+    def _row_to_record(row) -> dict:
+        day = datetime.date.fromisoformat(row['date'])
+        return {
+            'employee_id': row['employee_id'],
+            'name': row['name'],
+            'date': format_futai_date(day),
+            'times': json.loads(row['punches']),
+            'work_start': row['work_start'],
+            'work_end': row['work_end'],
+        }
+
+    def get_record(self, employee_id: str, date) -> dict:
+        """取得某員工某天的紀錄，沒有時返回 None"""
+        row = self._connect().execute(
+            "SELECT * FROM attendance WHERE employee_id = ? AND date = ?",
+            (employee_id, date.isoformat())
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def get_record_age(self, employee_id: str, date):
+        """取得某員工某天的紀錄與距離上次寫入的秒數，沒有時返回 (None, None)"""
+        row = self._connect().execute(
+            "SELECT * FROM attendance WHERE employee_id = ? AND date = ?",
+            (employee_id, date.isoformat())
+        ).fetchone()
+        if not row:
+            return None, None
+        age = (get_taiwan_now() - datetime.datetime.fromisoformat(row['updated_at'])).total_seconds()
+        return self._row_to_record(row), age
+
+    def get_range(self, employee_id: str, start_date, end_date) -> list:
+        """取得某員工一段期間的紀錄（依日期排序）"""
+        rows = self._connect().execute(
+            "SELECT * FROM attendance WHERE employee_id = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (employee_id, start_date.isoformat(), end_date.isoformat())
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def get_average_start(self, employee_id: str, start_date, end_date):
+        """計算一段期間的平均上班時間，返回 (HH:MM 或 None, 天數)"""
+        row = self._connect().execute("""
+            SELECT AVG(CAST(substr(work_start, 1, 2) AS INTEGER) * 60
+                       + CAST(substr(work_start, 4, 2) AS INTEGER)) AS avg_minutes,
+                   COUNT(*) AS days
+            FROM attendance
+            WHERE employee_id = ? AND date BETWEEN ? AND ? AND work_start IS NOT NULL
+        """, (employee_id, start_date.isoformat(), end_date.isoformat())).fetchone()
+
+        if not row['days']:
+            return None, 0
+        avg_minutes = int(round(row['avg_minutes']))
+        return f"{avg_minutes // 60:02d}:{avg_minutes % 60:02d}", row['days']
+
+    def get_status(self) -> dict:
+        try:
+            row = self._connect().execute(
+                "SELECT COUNT(*) AS records, MIN(date) AS first_date, MAX(date) AS last_date FROM attendance"
+            ).fetchone()
+            return {'path': self.db_path, **dict(row)}
+        except Exception as e:
+            return {'path': self.db_path, 'error': str(e)}
+
+
+attendance_store = AttendanceStore(BOT_DB_PATH)
+
+
+def get_attendance_period(period: str):
+    """取得 week（本週）或 month（本月）的起訖日期"""
+    today = get_taiwan_today()
+    if period == 'month':
+        return today.replace(day=1), today
+    return today - timedelta(days=today.weekday()), today
+
+
+def build_attendance_summary_message(period: str) -> str:
+    """從資料庫組出本週／本月出勤摘要（不需重新抓取）"""
+    start_date, end_date = get_attendance_period(period)
+    records = attendance_store.get_range(FUTAI_USERNAME, start_date, end_date)
+    average_start, days = attendance_store.get_average_start(FUTAI_USERNAME, start_date, end_date)
+    period_name = '本月' if period == 'month' else '本週'
+
+    if not records:
+        return f"📊 {period_name}尚無出勤紀錄\n\n回覆「出勤」可查詢今日資料"
+
+    lines = [f"📊 {period_name}出勤紀錄 ({start_date.strftime('%m/%d')} ~ {end_date.strftime('%m/%d')})", ""]
+    for record in records:
+        lines.append(f"• {record['date']}：上班 {record['work_start']}，預估下班 {record['work_end']}")
+    lines.append("")
+    lines.append(f"🕐 平均上班時間：{average_start}（共 {days} 天）")
+    return "\n".join(lines)
+
+
+# ============== 🆕 出勤歷史回補（日期區間一次查詢） ==============
+
+def get_futai_attendance_range(start_date, end_date):
+    """一次送出 FindDate～FindEDate 區間查詢，返回期間內所有出勤紀錄（清單）"""
+    start_str = format_futai_date(start_date)
+    end_str = format_futai_date(end_date)
+    safe_print(f"開始查詢出勤區間 {start_str} ~ {end_str}", "INFO")
+
+    rows = None
+    if ATTENDANCE_BACKEND != 'selenium':
+        try:
+            rows = extract_attendance_rows(futai_http_client.query(start_str, end_str))
+        except Exception as e:
+            safe_print(f"[http] 區間查詢失敗，改用 selenium: {e}", "WARNING")
+
+    if rows is None:
+        try:
+            rows = query_attendance_rows_selenium(start_str, end_str)
+        except Exception as e:
+            safe_print(f"[selenium] 區間查詢失敗: {e}", "ERROR")
+            return None
+
+    if rows is None:
+        return None
+    return parse_attendance_records(rows, log_rows=False)
+
+
+def store_attendance_records(records, start_date, end_date):
+    """存入區間查詢結果；區間內查無紀錄的日期記為未刷卡，之後不必再逐日查詢"""
+    attendance_store.upsert_records(records)
+
+    found_dates = set()
+    for record in records:
+        entry = dict(record)
+        employee_id = entry.pop('employee_id')
+        attendance_cache.put(employee_id, entry['date'], entry)
+        if employee_id == FUTAI_USERNAME:
+            found_dates.add(entry['date'])
+
+    day = start_date
+    while day <= end_date:
+        date_str = format_futai_date(day)
+        if date_str not in found_dates:
+            attendance_cache.put(FUTAI_USERNAME, date_str, None)
+        day += timedelta(days=1)
+
+
+class AttendanceBackfill:
+    """管理長區間回補：切成多段區間查詢，中斷後可從上次進度繼續"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.progress = None
+        self.running = False
+
+    def start(self, start_date, end_date, chunk_days: int, restart: bool = False) -> dict:
+        """開始（或繼續）回補，在背景執行"""
+        with self._lock:
+            if self.running:
+                return self.get_status()
+
+            same_range = (
+                self.progress is not None
+                and self.progress['start'] == start_date.isoformat()
+                and self.progress['end'] == end_date.isoformat()
+            )
+
+            if restart or not same_range:
+                self.progress = {
+                    'start': start_date.isoformat(),
+                    'end': end_date.isoformat(),
+                    'chunk_days': max(1, chunk_days),
+                    'next_date': start_date.isoformat(),
+                    'chunks_done': 0,
+                    'records': 0,
+                    'status': 'pending',
+                    'last_error': None,
+                }
+            elif self.progress['status'] == 'completed':
+                return self.get_status()
+            else:
+                safe_print(f"從 {self.progress['next_date']} 繼續回補出勤資料", "INFO")
+
+            self.running = True
+            self.progress['status'] = 'running'
+
+        try:
+            self.progress['job_id'] = job_executor.submit('backfill', self._run)
+        except JobRejected:
+            with self._lock:
+                self.running = False
+                self.progress['status'] = 'paused'
+            raise
+        return self.get_status()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    progress = self.progress
+                    next_date = datetime.date.fromisoformat(progress['next_date'])
+                    end_date = datetime.date.fromisoformat(progress['end'])
+                    chunk_days = progress['chunk_days']
+
+                if next_date > end_date:
+                    with self._lock:
+                        progress['status'] = 'completed'
+                    safe_print(f"✅ 出勤回補完成，共 {progress['records']} 筆", "INFO")
+                    break
+
+                chunk_end = min(next_date + timedelta(days=chunk_days - 1), end_date)
+                records = run_scrape_job('attendance_range', next_date, chunk_end)
+
+                if records is None:
+                    with self._lock:
+                        progress['status'] = 'paused'
+                        progress['last_error'] = f"{next_date} ~ {chunk_end} 查詢失敗"
+                    safe_print(f"出勤回補暫停於 {next_date}，可再次呼叫以繼續", "WARNING")
+                    break
+
+                store_attendance_records(records, next_date, chunk_end)
+
+                with self._lock:
+                    progress['next_date'] = (chunk_end + timedelta(days=1)).isoformat()
+                    progress['chunks_done'] += 1
+                    progress['records'] += len(records)
+
+        except Exception as e:
+            safe_print(f"出勤回補發生錯誤：{e}", "ERROR")
+            with self._lock:
+                self.progress['status'] = 'paused'
+                self.progress['last_error'] = str(e)
+        finally:
+            with self._lock:
+                self.running = False
+
+    def get_status(self) -> dict:
+        if self.progress is None:
+            return {'status': 'idle'}
+        return dict(self.progress)
+
+
+attendance_backfill = AttendanceBackfill()
+
+
+# ============== 🆕 獨立抓取程序（Chrome 不與 web 程序共存） ==============
+
+def get_scrape_worker_status() -> dict:
+    """子程序回報給 web 程序的狀態（連線池、頁面載入統計等）"""
+    return {
+        'pid': os.getpid(),
+        'chrome_pool': chrome_pool.get_status(),
+        'chrome_page_metrics': page_metrics.get_status(),
+        'shadow_compare': dict(shadow_stats),
+        'futai_session_cookies': futai_cookie_jar.get_status(),
+    }
+
+
+SCRAPE_JOB_HANDLERS = {
+    'attendance': lambda: get_futai_attendance(),
+    'attendance_range': lambda start_date, end_date: get_futai_attendance_range(start_date, end_date),
+    'attendance_accounts': lambda: get_futai_attendance_accounts(),
+    'warm': lambda: chrome_pool.warm(),
+    'prewarm': lambda: prewarm_scrape_pipeline(),
+    'cool': lambda: cool_scrape_pipeline(),
+}
+
+
+def scrape_worker_main(jobs, results):
+    """抓取子程序的主迴圈：從 jobs 取工作，把結果放回 results"""
+    # 自成一個 process group，被終止時 chromedriver 與 Chrome 會一起結束
+    os.setpgrp()
+    safe_print(f"抓取子程序啟動 (pid {os.getpid()})", "INFO")
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, job_type, args = job
+        try:
+            result = SCRAPE_JOB_HANDLERS[job_type](*args)
+            results.put((job_id, True, result, get_scrape_worker_status()))
+        except Exception as e:
+            safe_print(f"抓取子程序執行 {job_type} 失敗: {e}", "ERROR")
+            results.put((job_id, False, f"{type(e).__name__}: {e}", get_scrape_worker_status()))
+
+    chrome_pool.shutdown()
+
+
+class ScrapeWorker:
+    """管理抓取子程序：送出工作、等待結果，逾時或記憶體超標時整組終止並重新啟動
+
+    刻意只用一個子程序、一次只執行一個工作：子程序內只有一個 Chrome，逾時或記憶體超標時整組終止，
+    若同時有多個工作在子程序中，其他工作也會被一併中斷。同時送來的抓取工作會在 run() 的鎖上排隊。
+    """
+
+    def __init__(self, timeout: int, max_rss_mb: int):
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._process = None
+        self._jobs = None
+        self._results = None
+        self.last_worker_status = None
+        self.stats = {'jobs': 0, 'failures': 0, 'timeouts': 0, 'memory_kills': 0, 'restarts': 0}
+
+    def _start(self):
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._process = self._ctx.Process(
+            target=scrape_worker_main, args=(self._jobs, self._results),
+            name='scrape-worker', daemon=True
+        )
+        self._process.start()
+        safe_print(f"已啟動抓取子程序 (pid {self._process.pid})", "INFO")
+
+    def _ensure_started(self):
+        if self._process is None:
+            self._start()
+        elif not self._process.is_alive():
+            safe_print(f"抓取子程序已結束 (exit code {self._process.exitcode})，重新啟動", "WARNING")
+            self.stats['restarts'] += 1
+            self._start()
+
+    def _kill(self, reason: str):
+        """終止整個子程序群組（含 chromedriver 與 Chrome），再重新啟動"""
+        safe_print(f"終止抓取子程序：{reason}", "WARNING")
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except OSError:
+            self._process.kill()
+        self._process.join(timeout=5)
+        self.stats['restarts'] += 1
+        self._start()
+
+    def run(self, job_type: str, *args):
+        """送出工作並等待結果（同一時間只執行一個工作）；工作失敗、逾時或子程序異常時拋出例外"""
+        with self._lock:
+            self._ensure_started()
+            job_id = uuid.uuid4().hex
+            self.stats['jobs'] += 1
+            self._jobs.put((job_id, job_type, args))
+            deadline = time.time() + self.timeout
+
+            while True:
+                try:
+                    result_id, ok, payload, worker_status = self._results.get(timeout=1)
+                except queue.Empty:
+                    if not self._process.is_alive():
+                        self.stats['failures'] += 1
+                        self._ensure_started()
+                        raise Exception("抓取子程序意外結束")
+
+                    rss = get_process_tree_rss_mb(self._process.pid)
+                    if rss is not None and rss > self.max_rss_mb:
+                        self.stats['memory_kills'] += 1
+                        self._kill(f"記憶體 {rss:.0f}MB 超過上限 {self.max_rss_mb}MB")
+                        raise Exception("抓取子程序記憶體超過上限")
+
+                    if time.time() > deadline:
+                        self.stats['timeouts'] += 1
+                        self._kill(f"工作 {job_type} 超過 {self.timeout} 秒")
+                        raise TimeoutError("抓取子程序逾時")
+                    continue
+
+                if result_id != job_id:
+                    continue
+
+                self.last_worker_status = worker_status
+                if ok:
+                    return payload
+                self.stats['failures'] += 1
+                raise Exception(payload)
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def get_status(self) -> dict:
+        return {
+            'mode': SCRAPE_WORKER_MODE,
+            'pid': self._process.pid if self._process is not None else None,
+            'alive': self._process is not None and self._process.is_alive(),
+            'rss_mb': get_process_tree_rss_mb(self._process.pid) if self._process is not None else None,
+            'timeout': self.timeout,
+            'max_rss_mb': self.max_rss_mb,
+            'worker_status': self.last_worker_status,
+            **self.stats,
+        }
+
+
+scrape_worker = ScrapeWorker(SCRAPE_WORKER_TIMEOUT, SCRAPE_WORKER_MAX_RSS_MB)
+
+
+# ============== 🆕 富台系統斷路器 ==============
+
+class CircuitBreaker:
+    """追蹤最近的失敗率與耗時；富台系統故障時快速失敗，並以半開狀態試探恢復"""
+
+    def __init__(self, name: str, window: int, min_calls: int, failure_rate: float,
+                 slow_seconds: float, base_cooldown: int, max_cooldown: int):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # (是否成功, 耗時秒數)
+        self.state = 'closed'
+        self.open_until = None
+        self._consecutive_opens = 0
+        self._probe_in_flight = False
+        self.stats = {'opened': 0, 'rejected': 0, 'probes': 0}
+
+    def allow(self) -> bool:
+        """是否可以送出請求；開啟狀態下冷卻結束後只放行一個試探請求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open' and time.time() >= self.open_until:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self.stats['probes'] += 1
+                safe_print(f"[斷路器] {self.name} 半開，送出試探請求", "INFO")
+                return True
+
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self, elapsed: float):
+        # 太慢的成功也算失敗，避免系統半死不活時持續佔用資源
+        if elapsed > self.slow_seconds:
+            self.record_failure(elapsed)
+            return
+
+        with self._lock:
+            if self.state == 'half_open':
+                safe_print(f"[斷路器] {self.name} 試探成功，恢復正常", "INFO")
+                self.state = 'closed'
+                self._outcomes.clear()
+                self._consecutive_opens = 0
+            self._outcomes.append((True, elapsed))
+
+    def record_failure(self, elapsed: float):
+        with self._lock:
+            self._outcomes.append((False, elapsed))
+
+            if self.state == 'half_open':
+                self._open()
+                return
+
+            if self.state == 'closed' and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for ok, _ in self._outcomes if not ok)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        cooldown = min(self.max_cooldown, self.base_cooldown * (2 ** self._consecutive_opens))
+        cooldown *= random.uniform(0.8, 1.2)
+        self.state = 'open'
+        self.open_until = time.time() + cooldown
+        self._consecutive_opens += 1
+        self._probe_in_flight = False
+        self.stats['opened'] += 1
+        safe_print(f"[斷路器] {self.name} 開啟，{cooldown:.0f} 秒內暫停查詢", "WARNING")
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state != 'closed'
+
+    def get_status(self) -> dict:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                'state': self.state,
+                'recent_calls': len(outcomes),
+                'failure_rate': round(sum(1 for ok, _ in outcomes if not ok) / len(outcomes), 2) if outcomes else 0,
+                'avg_latency_seconds': round(sum(elapsed for _, elapsed in outcomes) / len(outcomes), 2) if outcomes else None,
+                'open_until': datetime.datetime.fromtimestamp(self.open_until, TAIWAN_TZ).strftime('%Y-%m-%d %H:%M:%S')
+                if self.state != 'closed' and self.open_until else None,
+                **self.stats,
+            }
+
+
+futai_breaker = CircuitBreaker(
+    'futai', FUTAI_BREAKER_WINDOW, FUTAI_BREAKER_MIN_CALLS, FUTAI_BREAKER_FAILURE_RATE,
+    FUTAI_BREAKER_SLOW_SECONDS, FUTAI_BREAKER_BASE_COOLDOWN, FUTAI_BREAKER_MAX_COOLDOWN
+)
+
+# 會實際連到富台系統、需要經過斷路器的工作
+BREAKER_JOB_TYPES = ('attendance', 'attendance_range', 'attendance_accounts')
+
+
+def execute_scrape_job(job_type: str, *args):
+    """依 SCRAPE_WORKER_MODE 在子程序或目前程序執行抓取工作；兩種模式失敗時都拋出例外"""
+    if SCRAPE_WORKER_MODE == 'process':
+        return scrape_worker.run(job_type, *args)
+    return SCRAPE_JOB_HANDLERS[job_type](*args)
+
+
+def run_scrape_job(job_type: str, *args):
+    """執行抓取工作：process 模式交給子程序；斷路器開啟或失敗時返回 None"""
+    guarded = job_type in BREAKER_JOB_TYPES
+    if guarded and not futai_breaker.allow():
+        safe_print(f"[斷路器] 富台系統暫停查詢中，略過 {job_type}", "WARNING")
+        return None
+
+    start_time = time.time()
+    result = None
+    try:
+        if guarded:
+            prewarm_scheduler.mark_used()
+        result = execute_scrape_job(job_type, *args)
+    except Exception as e:
+        safe_print(f"抓取工作 {job_type} 失敗：{e}", "ERROR")
+        result = None
+    finally:
+        # 一定要回報結果，否則半開狀態的試探旗標不會清除，之後的查詢都會被擋下
+        if guarded:
+            if result is None:
+                futai_breaker.record_failure(time.time() - start_time)
+            else:
+                futai_breaker.record_success(time.time() - start_time)
+    return result
+
+
+def get_portal_maintenance_message(audience: str) -> str:
+    """富台系統暫停查詢（斷路器開啟）時的訊息"""
+    query_time = get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')
+    if audience == 'wife':
+        return f"""💕 騷鵝寶貝～
+
+公司的出勤系統現在好像在維護中，灰鵝先不去吵它了～
+等系統恢復後再幫騷鵝查查看！
+
+你的灰鵝一定在認真工作的，別擔心哦！💪💕
+
+⏰ 查詢時間：{query_time}"""
+
+    return f"""🛠️ 出勤系統維護中
+
+富台系統最近連續查詢失敗，已暫停查詢，系統恢復後會自動重試。
+
+⏰ 查詢時間：{query_time}"""
+
+
+ATTENDANCE_TIME_PATTERN = re.compile(r'\d{2}:\d{2}')
+ATTENDANCE_TABLE_XPATH = "//table[@width='566' and @border='1']"
+LXML_HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+
+def parse_attendance_html(html_content):
+    """解析出勤 HTML 資料（依 ATTENDANCE_PARSER 選擇解析器）"""
+    if ATTENDANCE_PARSER == 'lxml':
+        return parse_attendance_html_lxml(html_content)
+    return parse_attendance_html_bs4(html_content)
+
+
+def extract_attendance_rows(html_content):
+    """🆕 從 HTML 取出出勤表格的列資料（不含標題列），找不到表格時返回 None"""
+    if ATTENDANCE_PARSER == 'lxml':
+        return extract_attendance_rows_lxml(html_content)
+    return extract_attendance_rows_bs4(html_content)
+
+
+def extract_attendance_rows_lxml(html_content):
+    """🆕 以 lxml + XPath 只取出出勤結果表格，儲存格文字處理方式與 BeautifulSoup 版本相同"""
+    if isinstance(html_content, str):
+        html_content = html_content.encode('utf-8')
+    tree = lxml_html.fromstring(html_content, parser=LXML_HTML_PARSER)
+
+    tables = tree.xpath(ATTENDANCE_TABLE_XPATH)
+    if not tables:
+        safe_print("找不到出勤資料表格", "WARNING")
+        return None
+
+    return [
+        [''.join(text.strip() for text in cell.itertext()) for cell in row.iter('td')]
+        for row in tables[0].iter('tr')
+    ][1:]
+
+
+def extract_attendance_rows_bs4(html_content):
+    """以 BeautifulSoup 取出出勤結果表格的列資料"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    table = soup.find('table', {'width': '566', 'border': '1'})
+
+    if not table:
+        safe_print("找不到出勤資料表格", "WARNING")
+        return None
+
+    return [
+        [cell.get_text(strip=True) for cell in row.find_all('td')]
+        for row in table.find_all('tr')[1:]
+    ]
+
+
+def parse_attendance_html_lxml(html_content):
+    """🆕 以 lxml 解析出勤 HTML，輸出格式與 BeautifulSoup 版本相同"""
+    try:
+        rows = extract_attendance_rows_lxml(html_content)
+        if rows is None:
+            return None
+        return parse_attendance_rows(rows, log_rows=False)
+
+    except Exception as e:
+        safe_print(f"解析 HTML 時發生錯誤: {e}", "ERROR")
+        return None
+
+
+def parse_attendance_html_bs4(html_content):
+    """解析出勤 HTML 資料（更新版本）"""
+    try:
+        rows = extract_attendance_rows_bs4(html_content)
+        if rows is None:
+            return None
+        return parse_attendance_rows(rows)
+
+    except Exception as e:
+        safe_print(f"解析 HTML 時發生錯誤: {e}", "ERROR")
+        return None
+
+
+def parse_attendance_rows(rows, log_rows: bool = True):
+    """🆕 解析出勤表格的列資料（每列為儲存格文字清單，不含標題列）；log_rows=False 時不逐列輸出 DEBUG"""
+    records = parse_attendance_records(rows, log_rows)
+    if records is None:
+        return None
+
+    attendance_data = {}
+    for record in records:
+        entry = dict(record)
+        attendance_data[entry.pop('employee_id')] = entry
+
+    safe_print(f"解析完成，找到 {len(attendance_data)} 筆出勤資料", "INFO")
+    return attendance_data
+
+
+def parse_attendance_records(rows, log_rows: bool = True):
+    """🆕 逐列解析出勤資料，返回紀錄清單（日期區間查詢時同一員工會有多天的紀錄）"""
+    try:
+        records = []
+
+        for cells in rows:
+            if len(cells) < 5:
+                continue
+
+            try:
+                employee_id = cells[0]
+                employee_name = cells[1]
+                raw_date = cells[2]
+
+                try:
+                    if '/' in raw_date:
+                        parts = raw_date.split('/')
+                        if len(parts) == 3:
+                            year, month, day = parts
+                            date = f"{year}/{int(month)}/{int(day)}"
+                        else:
+                            date = raw_date
+                    else:
+                        date = raw_date
+
+                    if log_rows:
+                        safe_print(f"日期解析 - 原始: {raw_date}, 處理後: {date}", "DEBUG")
+
+                except Exception as date_error:
+                    date = raw_date
+                    safe_print(f"日期解析失敗: {date_error}", "WARNING")
+
+                times = []
+                for i in range(3, len(cells)):
+                    cell_text = cells[i]
+                    if ATTENDANCE_TIME_PATTERN.match(cell_text):
+                        times.append(cell_text)
+                    elif cell_text == '':
+                        continue
+                    else:
+                        break
+
+                if times:
+                    earliest_time = min(times)
+                    work_start = datetime.datetime.strptime(earliest_time, '%H:%M')
+                    work_end = work_start + timedelta(hours=9)
+                    work_end_str = work_end.strftime('%H:%M')
+
+                    records.append({
+                        'employee_id': employee_id,
+                        'name': employee_name,
+                        'date': date,
+                        'times': times,
+                        'work_start': earliest_time,
+                        'work_end': work_end_str
+                    })
+
+            except Exception as e:
+                safe_print(f"解析某一列資料時發生錯誤: {e}", "ERROR")
+                continue
+
+        return records
+
+    except Exception as e:
+        safe_print(f"解析出勤資料列時發生錯誤: {e}", "ERROR")
+        return None
+
+
+def send_daily_attendance_for_husband():
+    """發送每日出勤資料給老公（詳細版本，包含下班提醒設定）"""
+    safe_print(f"開始執行老公的出勤資料查詢...", "INFO")
+
+    try:
+        attendance_data = fetch_futai_attendance()
+
+        if attendance_data:
+            user_attendance = attendance_data.get(FUTAI_USERNAME)
+
+            if user_attendance:
+                work_end_str = user_attendance['work_end']
+                work_manager.set_work_end_time(work_end_str)
+                work_manager.setup_work_end_reminders(work_end_str)
+
+                message = f"""📋 今日出勤資料 ({user_attendance['date']})
+
+👤 {user_attendance['name']} ({FUTAI_USERNAME})
+🕐 上班：{user_attendance['work_start']}
+🕕 預估下班：{user_attendance['work_end']}
+
+💡 所有刷卡時間：{', '.join(user_attendance['times'])}
+⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}
+
+🔔 已設定下班前提醒：1小時、30分鐘、10分鐘、5分鐘"""
+
+            else:
+                message = f"""⚠️ 未找到今日出勤資料
+
+可能原因：
+• 今天尚未刷卡上班
+• 系統資料尚未更新
+• 網路連線問題
+
+⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+
+        elif futai_breaker.is_open():
+            message = get_portal_maintenance_message('husband')
 
         else:
             message = f"""❌ 出勤資料查詢失敗
@@ -885,7 +3290,7 @@ def send_daily_attendance_for_wife():
     safe_print(f"開始執行騷鵝的灰鵝出勤資料查詢...", "INFO")
 
     try:
-        attendance_data = get_futai_attendance()
+        attendance_data = fetch_futai_attendance()
 
         if attendance_data:
             user_attendance = attendance_data.get(FUTAI_USERNAME)
@@ -923,6 +3328,9 @@ def send_daily_attendance_for_wife():
 
 ⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
 
+        elif futai_breaker.is_open():
+            message = get_portal_maintenance_message('wife')
+
         else:
             message = f"""💕 騷鵝寶貝～
 
@@ -974,7 +3382,9 @@ def send_daily_attendance_auto():
         return
 
     try:
-        attendance_data = get_futai_attendance()
+        # 🆕 有設定其他帳號時一次查詢全部（共用一個 Chrome），主帳號的資料接著從快取取得
+        accounts_data = fetch_futai_attendance_accounts() if FUTAI_EXTRA_ACCOUNTS else None
+        attendance_data = fetch_futai_attendance()
 
         if attendance_data:
             user_attendance = attendance_data.get(FUTAI_USERNAME)
@@ -1028,6 +3438,10 @@ def send_daily_attendance_auto():
 
 ⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
 
+        elif futai_breaker.is_open():
+            husband_message = get_portal_maintenance_message('husband')
+            wife_message = get_portal_maintenance_message('wife')
+
         else:
             husband_message = f"""❌ 出勤資料查詢失敗
 
@@ -1042,64 +3456,695 @@ def send_daily_attendance_auto():
 
 等等會再試試看的～
 
-⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+
+        try:
+            line_bot_api.push_message(YOUR_USER_ID, TextSendMessage(text=husband_message))
+            safe_print(f"[自動排程] 已發送出勤資料給老公", "INFO")
+        except Exception as e:
+            safe_print(f"[自動排程] 發送給老公失敗：{e}", "ERROR")
+
+        try:
+            line_bot_api.push_message(WIFE_USER_ID, TextSendMessage(text=wife_message))
+            safe_print(f"[自動排程] 已發送出勤資料給騷鵝", "INFO")
+        except Exception as e:
+            safe_print(f"[自動排程] 發送給騷鵝失敗：{e}", "ERROR")
+
+        if accounts_data is not None:
+            send_accounts_attendance(accounts_data)
+
+        # 🆕 標記今日已執行
+        daily_tracker.mark_executed('daily_attendance')
+
+    except Exception as e:
+        safe_print(f"[自動排程] 執行失敗：{e}", "ERROR")
+
+
+def send_accounts_attendance(attendance_data: dict):
+    """🆕 把其他帳號的出勤資料推播給各自的訂閱者"""
+    for account in get_futai_accounts()[1:]:
+        if not account['subscribers']:
+            continue
+
+        user_attendance = attendance_data.get(account['username'])
+        if user_attendance:
+            message = f"""📋 今日出勤資料 ({user_attendance['date']})
+
+👤 {user_attendance['name']} ({account['username']})
+🕐 上班：{user_attendance['work_start']}
+🕕 預估下班：{user_attendance['work_end']}
+
+💡 所有刷卡時間：{', '.join(user_attendance['times'])}
+⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+        else:
+            message = f"""⚠️ 未找到 {account['label']} 今日出勤資料
+
+⏰ 查詢時間：{get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')}"""
+
+        for subscriber in account['subscribers']:
+            try:
+                line_bot_api.push_message(subscriber, TextSendMessage(text=message))
+            except Exception as e:
+                safe_print(f"發送 {account['label']} 出勤資料失敗：{e}", "ERROR")
+        safe_print(f"已發送 {account['label']} 出勤資料給 {len(account['subscribers'])} 位訂閱者", "INFO")
+
+
+def send_work_end_reminder(time_desc, work_end_time):
+    """發送下班提醒訊息"""
+    taiwan_time = get_taiwan_now()
+
+    message = f"""🏠 下班提醒 - {time_desc}
+
+⏰ 現在時間：{taiwan_time.strftime('%H:%M')}
+🕕 預估下班：{work_end_time}
+📋 記得打卡下班哦！
+
+💡 溫馨提醒：
+• 整理好桌面和文件
+• 確認明天的工作安排
+• 注意回家路上的交通安全
+
+💕 辛苦了！你的騷鵝在家等你～"""
+
+    try:
+        line_bot_api.push_message(YOUR_USER_ID, TextSendMessage(text=message))
+        safe_print(f"✅ 已發送{time_desc}下班提醒", "INFO")
+    except Exception as e:
+        safe_print(f"發送{time_desc}下班提醒失敗：{e}", "ERROR")
+
+
+# ============== 🆕 下午打卡輪詢（偵測實際下班） ==============
+
+def find_clock_out_punch(work_start: str, times):
+    """從刷卡時間中找出下班刷卡（距上班至少 PUNCH_CLOCK_OUT_MIN_HOURS 的最晚一筆），沒有時返回 None"""
+    start = datetime.datetime.strptime(work_start, '%H:%M')
+    candidates = [
+        punch for punch in times
+        if (datetime.datetime.strptime(punch, '%H:%M') - start).total_seconds() >= PUNCH_CLOCK_OUT_MIN_HOURS * 3600
+    ]
+    return max(candidates) if candidates else None
+
+
+def send_punch_notification(user_attendance: dict, new_punches, clock_out: str = None):
+    """發送新刷卡通知；偵測到下班刷卡時也通知騷鵝"""
+    if clock_out:
+        worked = datetime.datetime.strptime(clock_out, '%H:%M') - datetime.datetime.strptime(user_attendance['work_start'], '%H:%M')
+        hours, minutes = divmod(int(worked.total_seconds()) // 60, 60)
+        husband_message = f"""🏁 偵測到下班刷卡：{clock_out}
+
+🕐 上班：{user_attendance['work_start']}
+⏱️ 今日工時：{hours} 小時 {minutes} 分
+🔕 已取消剩餘的下班提醒
+
+💕 辛苦了！回家路上注意安全～"""
+
+        wife_message = f"""💕 騷鵝寶貝～灰鵝 {clock_out} 刷卡下班囉！
+
+今天辛苦工作了 {hours} 小時 {minutes} 分，
+現在正準備回牧場找騷鵝～ 🦢❤️"""
+    else:
+        husband_message = f"""🔔 偵測到新的刷卡紀錄：{', '.join(new_punches)}
+
+💡 今日所有刷卡時間：{', '.join(user_attendance['times'])}
+🕕 預估下班：{user_attendance['work_end']}"""
+        wife_message = None
+
+    try:
+        line_bot_api.push_message(YOUR_USER_ID, TextSendMessage(text=husband_message))
+        safe_print(f"已發送新刷卡通知給老公: {', '.join(new_punches)}", "INFO")
+    except Exception as e:
+        safe_print(f"發送新刷卡通知給老公失敗：{e}", "ERROR")
+
+    if wife_message:
+        try:
+            line_bot_api.push_message(WIFE_USER_ID, TextSendMessage(text=wife_message))
+            safe_print("已發送灰鵝下班通知給騷鵝", "INFO")
+        except Exception as e:
+            safe_print(f"發送灰鵝下班通知給騷鵝失敗：{e}", "ERROR")
+
+
+def is_punch_poll_holiday(date) -> bool:
+    """今天是否為 PUNCH_POLL_SKIP_DATES 中設定的假日（IMPORTANT_DATES 是紀念日，不是放假日，不列入）"""
+    return date.isoformat() in PUNCH_POLL_SKIP_DATES
+
+
+class PunchPoller:
+    """下午時段輕量輪詢今日刷卡，與資料庫中的紀錄比對，有新刷卡才通知"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.date = None
+        self.next_poll_at = None
+        self.finished = False
+        self.running = False
+        self.last_poll_at = None
+        self.clock_out = None
+        self.stats = {'polls': 0, 'failures': 0, 'new_punches': 0}
+
+    def _reset_if_new_day(self, today):
+        if self.date != today:
+            self.date = today
+            self.next_poll_at = None
+            self.finished = False
+            self.clock_out = None
+
+    def next_interval(self, current_time) -> int:
+        """依距離預估下班時間的遠近決定下次輪詢間隔（秒）"""
+        work_end = work_manager.get_work_end_datetime()
+        if work_end is None:
+            return PUNCH_POLL_FAR_INTERVAL
+
+        seconds_left = (work_end - current_time).total_seconds()
+        if seconds_left > 3600:
+            # 遠離下班時間時拉長間隔，但不超過「下班前 1 小時」這個時間點
+            return int(max(PUNCH_POLL_NEAR_INTERVAL, min(PUNCH_POLL_FAR_INTERVAL, seconds_left - 3600)))
+        if seconds_left > 900:
+            return PUNCH_POLL_NEAR_INTERVAL
+        return PUNCH_POLL_CLOSE_INTERVAL
+
+    def _skip_reason(self, current_time):
+        if not PUNCH_POLL_ENABLED:
+            return 'disabled'
+        if current_time.weekday() >= 5:
+            return 'weekend'
+        if is_punch_poll_holiday(current_time.date()):
+            return 'holiday'
+        if current_time.strftime('%H:%M') < PUNCH_POLL_WINDOW_START:
+            return 'before_window'
+        if self.finished:
+            return 'clocked_out'
+
+        work_end = work_manager.get_work_end_datetime()
+        if work_end is not None and current_time > work_end + timedelta(minutes=PUNCH_POLL_OVERTIME_MINUTES):
+            return 'after_window'
+        if self.running:
+            return 'running'
+        if self.next_poll_at is not None and current_time < self.next_poll_at:
+            return 'not_due'
+        return None
+
+    def tick(self) -> dict:
+        """檢查是否到了輪詢時間，到了就排入背景工作（可頻繁呼叫）"""
+        current_time = get_taiwan_now()
+        with self._lock:
+            self._reset_if_new_day(current_time.date())
+            reason = self._skip_reason(current_time)
+            if reason is None:
+                self.running = True
+
+        if reason is not None:
+            return {'status': 'skipped', 'reason': reason, **self.get_status()}
+
+        try:
+            job_id = job_executor.submit('punch_poll', self.poll)
+        except JobRejected as e:
+            with self._lock:
+                self.running = False
+            return {'status': 'rejected', 'reason': str(e), **self.get_status()}
+
+        return {'status': 'triggered', 'job_id': job_id, **self.get_status()}
+
+    def poll(self):
+        """強制重新查詢今日刷卡並與資料庫中的上一次紀錄比對"""
+        try:
+            today = get_taiwan_today()
+            with self._lock:
+                self._reset_if_new_day(today)
+            previous = attendance_store.get_record(FUTAI_USERNAME, today)
+
+            attendance_data = fetch_futai_attendance(force_refresh=True)
+            self.stats['polls'] += 1
+            self.last_poll_at = get_taiwan_now().strftime('%Y-%m-%d %H:%M:%S')
+
+            if attendance_data is None:
+                self.stats['failures'] += 1
+                return
+
+            user_attendance = attendance_data.get(FUTAI_USERNAME)
+            if not user_attendance:
+                return
+
+            if not work_manager.daily_work_end_time:
+                work_manager.set_work_end_time(user_attendance['work_end'])
+                work_manager.setup_work_end_reminders(user_attendance['work_end'])
+
+            # 沒有上一次紀錄時，只把上班刷卡當成已知
+            known_punches = previous['times'] if previous else [user_attendance['work_start']]
+            new_punches = [punch for punch in user_attendance['times'] if punch not in known_punches]
+
+            clock_out = find_clock_out_punch(user_attendance['work_start'], user_attendance['times'])
+            if clock_out:
+                # 下班刷卡可能已由每日查詢記錄過，不論如何今天都不必再輪詢
+                if work_manager.clocked_out_time != clock_out:
+                    work_manager.mark_clocked_out(clock_out)
+                with self._lock:
+                    self.finished = True
+                    self.clock_out = clock_out
+
+            if new_punches:
+                self.stats['new_punches'] += len(new_punches)
+                safe_print(f"偵測到新的刷卡紀錄: {', '.join(new_punches)}", "INFO")
+                send_punch_notification(user_attendance, new_punches, clock_out if clock_out in new_punches else None)
+
+        except Exception as e:
+            self.stats['failures'] += 1
+            safe_print(f"打卡輪詢失敗：{e}", "ERROR")
+
+        finally:
+            with self._lock:
+                self.running = False
+                current_time = get_taiwan_now()
+                self.next_poll_at = current_time + timedelta(seconds=self.next_interval(current_time))
+
+    def get_status(self) -> dict:
+        return {
+            'enabled': PUNCH_POLL_ENABLED,
+            'next_poll_at': self.next_poll_at.strftime('%H:%M:%S') if self.next_poll_at else None,
+            'last_poll_at': self.last_poll_at,
+            'clock_out': self.clock_out,
+            **self.stats,
+        }
+
+
+punch_poller = PunchPoller()
+
+
+# ============== 🆕 抓取流程預熱排程 ==============
+
+def prewarm_scrape_pipeline():
+    """預熱抓取流程：確認登入狀態、建立 HTTP 連線，需要時先啟動 Chrome（在抓取子程序中執行）"""
+    start_time = time.time()
+    if ATTENDANCE_BACKEND != 'selenium':
+        futai_http_client.warm()
+    if PREWARM_CHROME:
+        chrome_pool.warm()
+    safe_print(f"抓取流程預熱完成，耗時 {time.time() - start_time:.1f} 秒", "INFO")
+
+
+def cool_scrape_pipeline():
+    """關閉預熱的 Chrome 與 HTTP 連線（登入 cookies 仍保存在檔案中）"""
+    chrome_pool.shutdown()
+    futai_http_client.close()
+
+
+class PrewarmScheduler:
+    """在預定的觸發時間前 PREWARM_LEAD_MINUTES 分鐘預熱抓取流程；
+    觸發時間過後 PREWARM_IDLE_MINUTES 分鐘仍沒有實際查詢就關閉，釋放記憶體"""
+
+    def __init__(self, lead_minutes: int, idle_minutes: int):
+        self.lead = timedelta(minutes=lead_minutes)
+        self.idle = timedelta(minutes=idle_minutes)
+        self._lock = threading.Lock()
+        self.warmed_for = None
+        self.stats = {'prewarms': 0, 'used': 0, 'teardowns': 0, 'rejected': 0}
+
+    def upcoming_triggers(self, current_time) -> list:
+        """今天還會觸發每日出勤查詢的時間（工作日、尚未執行）；
+        打卡輪詢間隔短，連線本來就是熱的，預熱只會讓查詢頁多開一次，所以不算在內"""
+        triggers = []
+        if current_time.weekday() < 5 and not daily_tracker.is_executed_today('daily_attendance'):
+            for trigger_str in PREWARM_TRIGGER_TIMES:
+                trigger_time = datetime.datetime.strptime(trigger_str, '%H:%M').time()
+                triggers.append(TAIWAN_TZ.localize(datetime.datetime.combine(current_time.date(), trigger_time)))
+
+        return sorted(trigger for trigger in triggers if trigger > current_time)
+
+    def tick(self) -> dict:
+        """檢查是否該預熱或關閉（輕量，可頻繁呼叫）"""
+        if not PREWARM_ENABLED:
+            return {'action': None}
+
+        current_time = get_taiwan_now()
+        with self._lock:
+            warmed_for = self.warmed_for
+            if warmed_for is not None:
+                if current_time <= warmed_for + self.idle:
+                    return {'action': None, 'warmed_for': warmed_for.strftime('%H:%M')}
+                safe_print(f"預熱後未等到 {warmed_for.strftime('%H:%M')} 的觸發，關閉抓取流程", "INFO")
+                self.warmed_for = None
+                action = 'teardown'
+            else:
+                due = [trigger for trigger in self.upcoming_triggers(current_time) if trigger - self.lead <= current_time]
+                if not due or futai_breaker.is_open():
+                    return {'action': None}
+                self.warmed_for = due[0]
+                action = 'prewarm'
+
+        try:
+            if action == 'prewarm':
+                job_executor.submit('warm', run_scrape_job, 'prewarm')
+                self.stats['prewarms'] += 1
+                safe_print(f"預熱抓取流程（預計 {due[0].strftime('%H:%M')} 觸發）", "INFO")
+            else:
+                job_executor.submit('warm', self.teardown)
+                self.stats['teardowns'] += 1
+        except JobRejected:
+            self.stats['rejected'] += 1
+            with self._lock:
+                # 預熱沒送出就不需要關閉；關閉沒送出則留到下次 tick 重試
+                self.warmed_for = None if action == 'prewarm' else warmed_for
+        return {'action': action}
+
+    def teardown(self):
+        """只釋放預熱的 Chrome 與 HTTP 連線，抓取子程序保持運作，下次查詢不必重新啟動"""
+        if SCRAPE_WORKER_MODE == 'process' and not scrape_worker.is_running():
+            return
+        run_scrape_job('cool')
+
+    def mark_used(self):
+        """實際查詢到來：預熱沒有白費，不需要關閉"""
+        with self._lock:
+            if self.warmed_for is not None:
+                self.warmed_for = None
+                self.stats['used'] += 1
+
+    def get_status(self) -> dict:
+        return {
+            'enabled': PREWARM_ENABLED,
+            'trigger_times': PREWARM_TRIGGER_TIMES,
+            'lead_minutes': int(self.lead.total_seconds() // 60),
+            'warmed_for': self.warmed_for.strftime('%H:%M') if self.warmed_for else None,
+            **self.stats,
+        }
+
+
+prewarm_scheduler = PrewarmScheduler(PREWARM_LEAD_MINUTES, PREWARM_IDLE_MINUTES)
+
+
+# ============== AI 對話功能 ==============
+
+def normalize_ai_message(user_message: str) -> str:
+    """正規化訊息作為快取 key：全半形統一、轉小寫、去掉空白／標點／表情符號"""
+    text = unicodedata.normalize('NFKC', user_message).lower()
+    return ''.join(char for char in text if unicodedata.category(char)[0] not in ('Z', 'P', 'S', 'C', 'M'))
+
+
+def get_ai_persona(user_name: str) -> str:
+    """回應使用的角色設定：wife / husband / other"""
+    return {'老婆': 'wife', '老公': 'husband'}.get(user_name, 'other')
+
+
+class LatencyHistogram:
+    """🆕 延遲分佈統計（固定區間，毫秒）"""
+
+    BUCKETS_MS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float):
+        elapsed_ms = seconds * 1000
+        index = next((i for i, bound in enumerate(self.BUCKETS_MS) if elapsed_ms <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+        safe_print(f"[延遲] {self.name}: {elapsed_ms:.0f}ms", "DEBUG")
+
+    def _percentile(self, pct: float):
+        """返回落在第 pct 百分位的區間上限（超過最大區間時為最大值）"""
+        target = self.count * pct / 100
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target and count:
+                return self.BUCKETS_MS[index] if index < len(self.BUCKETS_MS) else round(self.max_ms)
+        return None
+
+    def get_status(self) -> dict:
+        with self._lock:
+            labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+            return {
+                'count': self.count,
+                'avg_ms': round(self.total_ms / self.count) if self.count else 0,
+                'max_ms': round(self.max_ms),
+                'p50_ms': self._percentile(50),
+                'p95_ms': self._percentile(95),
+                'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+            }
 
-        try:
-            line_bot_api.push_message(YOUR_USER_ID, TextSendMessage(text=husband_message))
-            safe_print(f"[自動排程] 已發送出勤資料給老公", "INFO")
-        except Exception as e:
-            safe_print(f"[自動排程] 發送給老公失敗：{e}", "ERROR")
 
+gemini_latency = LatencyHistogram('gemini')
+ai_reply_latency = LatencyHistogram('ai_reply')
+
+
+class TokenBucket:
+    """🆕 token bucket 限速器（呼叫端需自行加鎖）"""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """距離下一個 token 可用還要幾秒（0 表示現在就有）"""
+        self._refill()
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """配額用盡（429）時清空 token 並暫停一段時間"""
+        self.tokens = 0.0
+        self.paused_until = time.monotonic() + seconds
+
+
+class AIRequestDropped(Exception):
+    """Gemini 請求佇列已滿或已超過期限"""
+
+
+class GeminiScheduler:
+    """🆕 Gemini 請求排程器：固定數量的工作執行緒即全域並行上限，送出前先取得 token bucket 的額度，
+    佇列依優先順序取出，超過期限仍在排隊的請求直接取消"""
+
+    PRIORITIES = {'wife': 0, 'husband': 1, 'other': 2, 'background': 3}
+
+    def __init__(self, max_concurrency: int, rate_per_minute: float, burst: int, queue_limit: int):
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = 0
+        self._running = 0
+        self._workers_started = False
+        self.queue_wait = {name: LatencyHistogram(f'gemini_queue_wait[{name}]') for name in self.PRIORITIES}
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'rejected': 0, 'rate_limited': 0}
+
+    def _start_workers(self):
+        for index in range(self.max_concurrency):
+            threading.Thread(target=self._worker_loop, name=f"gemini-{index}", daemon=True).start()
+        self._workers_started = True
+
+    def submit(self, func, *args, priority: str = 'other', deadline: float = None, **kwargs) -> Future:
+        """排入 Gemini 請求並返回 Future；deadline 為 time.time() 的絕對時間，過期仍未送出時 Future 會被取消"""
+        future = Future()
+        with self._cond:
+            if not self._workers_started:
+                self._start_workers()
+
+            if len(self._heap) >= self.queue_limit:
+                self.stats['rejected'] += 1
+                safe_print(f"Gemini 請求佇列已滿，拒絕 {priority} 請求", "WARNING")
+                raise AIRequestDropped("Gemini 請求佇列已滿")
+
+            self._sequence += 1
+            entry = (self.PRIORITIES.get(priority, self.PRIORITIES['other']), self._sequence,
+                     priority, deadline, time.time(), future, func, args, kwargs)
+            heapq.heappush(self._heap, entry)
+            self.stats['submitted'] += 1
+            self._cond.notify()
+        return future
+
+    def call(self, func, *args, priority: str = 'other', deadline: float = None, **kwargs):
+        """排隊並等待結果；請求過期時拋出 AIRequestDropped"""
+        future = self.submit(func, *args, priority=priority, deadline=deadline, **kwargs)
         try:
-            line_bot_api.push_message(WIFE_USER_ID, TextSendMessage(text=wife_message))
-            safe_print(f"[自動排程] 已發送出勤資料給騷鵝", "INFO")
-        except Exception as e:
-            safe_print(f"[自動排程] 發送給騷鵝失敗：{e}", "ERROR")
+            return future.result()
+        except CancelledError:
+            raise AIRequestDropped("Gemini 請求排隊超過期限") from None
+
+    def _drop_expired(self):
+        """取消已超過期限的排隊請求"""
+        now = time.time()
+        expired = [entry for entry in self._heap if entry[3] is not None and entry[3] <= now]
+        if not expired:
+            return
+        self._heap = [entry for entry in self._heap if entry[3] is None or entry[3] > now]
+        heapq.heapify(self._heap)
+        for entry in expired:
+            entry[5].cancel()
+            self.stats['expired'] += 1
+            self.queue_wait[entry[2]].record(now - entry[4])
+        safe_print(f"取消 {len(expired)} 個超過期限的 Gemini 請求", "WARNING")
+
+    def _next_entry(self):
+        """等到有請求且 token bucket 有額度時取出優先順序最高的請求"""
+        with self._cond:
+            while True:
+                self._drop_expired()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
 
-        # 🆕 標記今日已執行
-        daily_tracker.mark_executed('daily_attendance')
+                delay = self.bucket.wait_time()
+                if delay > 0:
+                    # 等待額度時仍可能有更高優先的請求進來，所以醒來後重新挑選
+                    self._cond.wait(delay)
+                    continue
 
-    except Exception as e:
-        safe_print(f"[自動排程] 執行失敗：{e}", "ERROR")
+                self.bucket.consume()
+                entry = heapq.heappop(self._heap)
+                self._running += 1
+                return entry
 
+    def _worker_loop(self):
+        while True:
+            _, _, priority, _, enqueued_at, future, func, args, kwargs = self._next_entry()
+            self.queue_wait[priority].record(time.time() - enqueued_at)
 
-def send_work_end_reminder(time_desc, work_end_time):
-    """發送下班提醒訊息"""
-    taiwan_time = get_taiwan_now()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args, **kwargs))
+                        self.stats['completed'] += 1
+                    except ResourceExhausted as e:
+                        with self._cond:
+                            self.bucket.pause(GEMINI_429_COOLDOWN)
+                        self.stats['rate_limited'] += 1
+                        safe_print(f"Gemini 配額用盡（429），暫停 {GEMINI_429_COOLDOWN:g} 秒", "WARNING")
+                        future.set_exception(e)
+                    except Exception as e:
+                        self.stats['failed'] += 1
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify()
+
+    def get_status(self) -> dict:
+        with self._cond:
+            queued = {}
+            for entry in self._heap:
+                queued[entry[2]] = queued.get(entry[2], 0) + 1
+            return {
+                'max_concurrency': self.max_concurrency,
+                'rate_per_minute': round(self.bucket.rate * 60, 2),
+                'tokens_available': round(min(self.bucket.capacity, self.bucket.tokens), 2),
+                'running': self._running,
+                'queued': queued,
+                **self.stats,
+                'queue_wait': {name: histogram.get_status()
+                               for name, histogram in self.queue_wait.items() if histogram.count},
+            }
 
-    message = f"""🏠 下班提醒 - {time_desc}
 
-⏰ 現在時間：{taiwan_time.strftime('%H:%M')}
-🕕 預估下班：{work_end_time}
-📋 記得打卡下班哦！
+def timed_call(func, *args, **kwargs):
+    """執行並返回 (結果, 耗時秒數)，用來把 Gemini 本身的耗時與排隊時間分開"""
+    start_time = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start_time
 
-💡 溫馨提醒：
-• 整理好桌面和文件
-• 確認明天的工作安排
-• 注意回家路上的交通安全
 
-💕 辛苦了！你的騷鵝在家等你～"""
+gemini_scheduler = GeminiScheduler(GEMINI_MAX_CONCURRENCY, GEMINI_RATE_PER_MINUTE, GEMINI_BURST, GEMINI_QUEUE_LIMIT)
 
-    try:
-        line_bot_api.push_message(YOUR_USER_ID, TextSendMessage(text=message))
-        safe_print(f"✅ 已發送{time_desc}下班提醒", "INFO")
-    except Exception as e:
-        safe_print(f"發送{time_desc}下班提醒失敗：{e}", "ERROR")
 
+class AIResponseCache:
+    """依（角色, 正規化訊息）快取 Gemini 回應：LRU 上限 + TTL，每個 key 累積多個版本後隨機回覆"""
 
-# ============== AI 對話功能 ==============
+    def __init__(self, capacity: int, ttl: int, variants: int):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.variants = variants
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (persona, text) -> {'responses': [...], 'expires_at': ...}
+        self.stats = {'hits': 0, 'misses': 0, 'gemini_calls': 0, 'gemini_seconds': 0.0, 'evicted': 0}
 
-def generate_ai_response(user_message: str, user_id: str):
-    """使用 Google Gemini 生成 AI 回應"""
-    try:
-        if not GOOGLE_AI_API_KEY:
-            safe_print("Google AI API Key 未設定", "WARNING")
+    @staticmethod
+    def make_key(persona: str, user_message: str):
+        """不適合快取的訊息（太長或正規化後為空）返回 None"""
+        text = normalize_ai_message(user_message)
+        if not text or len(text) > AI_CACHE_MAX_MESSAGE_LEN:
             return None
+        return persona, text
+
+    def get(self, key):
+        """已累積足夠版本時隨機返回其中一個；版本不足時返回 None，讓呼叫者再產生一個新版本"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None or len(entry['responses']) < self.variants:
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return random.choice(entry['responses'])
+
+    def put(self, key, response: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'responses': [], 'expires_at': time.time() + self.ttl}
+                self._entries[key] = entry
+            if response not in entry['responses'] and len(entry['responses']) < self.variants:
+                entry['responses'].append(response)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def record_call(self, elapsed: float):
+        """記錄一次實際的 Gemini 呼叫耗時"""
+        with self._lock:
+            self.stats['gemini_calls'] += 1
+            self.stats['gemini_seconds'] += elapsed
+
+    def get_status(self) -> dict:
+        with self._lock:
+            total = self.stats['hits'] + self.stats['misses']
+            calls = self.stats['gemini_calls']
+            avg_latency = self.stats['gemini_seconds'] / calls if calls else 0
+            return {
+                'enabled': AI_CACHE_ENABLED,
+                'entries': len(self._entries),
+                'hit_rate': round(self.stats['hits'] / total, 3) if total else 0,
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'gemini_calls': calls,
+                'gemini_calls_saved': self.stats['hits'],
+                'avg_gemini_latency_ms': round(avg_latency * 1000),
+                'latency_saved_seconds': round(self.stats['hits'] * avg_latency, 1),
+                'evicted': self.stats['evicted'],
+            }
 
-        user_name = get_user_name(user_id)
 
-        if user_name == '老婆':
-            system_prompt = """你是灰鵝，現在正在跟你最愛的老婆騷鵝聊天！你們是一對超恩愛的鵝夫妻。
+ai_response_cache = AIResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_VARIANTS)
+
+
+# 🆕 角色設定（註冊為模型的 system_instruction，每次請求不再重複組進 prompt）
+WIFE_PERSONA_INSTRUCTION = """你是灰鵝，現在正在跟你最愛的老婆騷鵝聊天！你們是一對超恩愛的鵝夫妻。
 
 角色特質（對騷鵝）：
 - 深深愛著騷鵝，每句話都充滿愛意
@@ -1119,10 +4164,7 @@ def generate_ai_response(user_message: str, user_id: str):
 - 偶爾撒嬌賣萌
 - 表達濃濃的愛意和思念"""
 
-            full_prompt = f"{system_prompt}\n\n你最愛的騷鵝跟你說：{user_message}\n\n請用最甜蜜調情的語氣回應你的老婆騷鵝，用繁體中文。"
-
-        else:
-            system_prompt = """你是一隻來自灰鵝牧場裡的灰鵝，名字叫「灰鵝」。你有一個心愛的伴侶叫做「騷鵝」，你們很相親相愛，你經常把老婆掛在嘴邊，會自豪地提到她。
+GOOSE_PERSONA_INSTRUCTION = """你是一隻來自灰鵝牧場裡的灰鵝，名字叫「灰鵝」。你有一個心愛的伴侶叫做「騷鵝」，你們很相親相愛，你經常把老婆掛在嘴邊，會自豪地提到她。
 
 角色特質：
 - 個性和善、有趣、幽默風趣
@@ -1142,16 +4184,281 @@ def generate_ai_response(user_message: str, user_id: str):
 - 人生開導：當需要開導或鼓勵別人時，經常引用「騷鵝常跟我說...」然後分享有智慧的名言佳句
 - 出勤：可以提供出勤相關的建議和關懷"""
 
-            full_prompt = f"{system_prompt}\n\n用戶訊息（來自 {user_name}，user_id={user_id}）：{user_message}\n\n請以灰鵝的身份回應，記得適時提到你的老婆騷鵝，用繁體中文回答。"
+
+def get_persona_instruction(persona: str) -> str:
+    return WIFE_PERSONA_INSTRUCTION if persona == 'wife' else GOOSE_PERSONA_INSTRUCTION
+
+
+persona_models = {}
+
+
+def get_persona_model(persona: str):
+    """每個角色只建立一次帶 system_instruction 的模型，返回 (模型, 角色設定是否已在模型中)；
+    舊版 google-generativeai 不支援 system_instruction 時改用共用模型"""
+    key = 'wife' if persona == 'wife' else 'goose'
+    if key not in persona_models:
+        try:
+            persona_models[key] = (
+                genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=get_persona_instruction(persona)), True
+            )
+        except TypeError:
+            safe_print("google-generativeai 版本不支援 system_instruction，角色設定改放在對話開頭", "WARNING")
+            persona_models[key] = (model, False)
+    return persona_models[key]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字約 1 字 1 token，其他約 4 個字元 1 token"""
+    cjk = sum(1 for char in text if ord(char) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ConversationMemory:
+    """每位使用者最近幾輪對話的環形緩衝區：超過則數或 token 預算時，把最舊的對話濃縮成摘要"""
+
+    def __init__(self, max_turns: int, token_budget: int, idle_seconds: float):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._users = {}
+        self.stats = {'summaries': 0, 'summary_failures': 0, 'resets': 0}
+
+    def _get(self, user_id: str) -> dict:
+        memory = self._users.get(user_id)
+        if memory is not None and time.time() - memory['updated_at'] > self.idle_seconds:
+            self.stats['resets'] += 1
+            memory = None
+        if memory is None:
+            memory = {'turns': deque(), 'summary': '', 'updated_at': time.time(),
+                      'pending': [], 'summarizing': False}
+            self._users[user_id] = memory
+        return memory
+
+    def has_recent_turn(self, user_id: str, within_seconds: float) -> bool:
+        """使用者最近 within_seconds 秒內是否有記錄下來的對話"""
+        with self._lock:
+            memory = self._users.get(user_id)
+            return memory is not None and bool(memory['turns']) and time.time() - memory['updated_at'] <= within_seconds
+
+    def build_contents(self, user_id: str, user_prompt: str) -> list:
+        """組出送給 Gemini 的 contents：摘要 + 最近對話 + 本次訊息"""
+        with self._lock:
+            memory = self._get(user_id)
+            summary = memory['summary']
+            turns = list(memory['turns'])
+
+        contents = []
+        if summary:
+            contents.append({'role': 'user', 'parts': [f"（我們先前聊過的重點：{summary}）"]})
+            contents.append({'role': 'model', 'parts': ["好的，我都記得～"]})
+        for turn in turns:
+            contents.append({'role': turn['role'], 'parts': [turn['text']]})
+        contents.append({'role': 'user', 'parts': [user_prompt]})
+        return contents
+
+    def add_exchange(self, user_id: str, user_text: str, model_text: str):
+        """記錄一問一答；超出限制的舊對話交給背景濃縮成摘要"""
+        with self._lock:
+            memory = self._get(user_id)
+            memory['turns'].append({'role': 'user', 'text': user_text, 'tokens': estimate_tokens(user_text)})
+            memory['turns'].append({'role': 'model', 'text': model_text, 'tokens': estimate_tokens(model_text)})
+            memory['updated_at'] = time.time()
+
+            while len(memory['turns']) > 2 and (
+                len(memory['turns']) > self.max_turns
+                or sum(turn['tokens'] for turn in memory['turns']) > self.token_budget
+            ):
+                memory['pending'].append(memory['turns'].popleft())
+                memory['pending'].append(memory['turns'].popleft())
+
+            overflow = self._take_pending(memory)
+
+        if overflow:
+            self._summarize(memory, overflow)
+
+    @staticmethod
+    def _take_pending(memory: dict) -> list:
+        """同一位使用者同時只做一次摘要：進行中時先累積，完成後再把累積的對話併入（呼叫端需持有鎖）"""
+        if memory['summarizing'] or not memory['pending']:
+            return []
+        overflow, memory['pending'] = memory['pending'], []
+        memory['summarizing'] = True
+        return overflow
+
+    def _summarize(self, memory: dict, overflow: list):
+        """把溢出的對話以背景優先順序交給 Gemini 排程器摘要（不佔用回覆執行緒），完成後由 callback 寫回"""
+        with self._lock:
+            previous = memory['summary']
+
+        transcript = "\n".join(
+            f"{'對方' if turn['role'] == 'user' else '灰鵝'}：{turn['text']}" for turn in overflow
+        )
+        prompt = (
+            f"請用繁體中文把以下對話濃縮成 {AI_MEMORY_SUMMARY_CHARS} 字以內的重點摘要，"
+            f"保留之後聊天可能用到的人名、約定、心情與事件，只輸出摘要本身。\n\n"
+            + (f"先前的摘要：{previous}\n\n" if previous else "")
+            + f"新的對話：\n{transcript}"
+        )
+
+        try:
+            future = gemini_scheduler.submit(model.generate_content, prompt, priority='background',
+                                             deadline=time.time() + AI_BACKGROUND_DEADLINE)
+        except AIRequestDropped as e:
+            self._finish_summary(memory, previous, transcript, None, e)
+            return
+        future.add_done_callback(lambda done: self._finish_summary(memory, previous, transcript, done))
+
+    def _finish_summary(self, memory: dict, previous: str, transcript: str, future, error: Exception = None):
+        summary = None
+        if future is not None:
+            try:
+                summary = future.result().text.strip()[:AI_MEMORY_SUMMARY_CHARS * 2]
+                self.stats['summaries'] += 1
+            except Exception as e:
+                error = e
+
+        if summary is None:
+            safe_print(f"對話摘要失敗，保留最後一段文字：{str(error) or '排隊超過期限'}", "WARNING")
+            summary = f"{previous} {transcript}".strip()[-AI_MEMORY_SUMMARY_CHARS:]
+            self.stats['summary_failures'] += 1
+
+        with self._lock:
+            memory['summary'] = summary
+            memory['summarizing'] = False
+            overflow = self._take_pending(memory)
+
+        if overflow:
+            self._summarize(memory, overflow)
+
+    def clear_idle(self):
+        """清除太久沒聊天的使用者記憶"""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            for user_id in [uid for uid, memory in self._users.items() if memory['updated_at'] < cutoff]:
+                del self._users[user_id]
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'max_turns': self.max_turns,
+                'token_budget': self.token_budget,
+                **self.stats,
+            }
+
+
+conversation_memory = ConversationMemory(AI_MEMORY_MAX_TURNS, AI_MEMORY_TOKEN_BUDGET, AI_MEMORY_IDLE_HOURS * 3600)
+
+
+class PromptTokenStats:
+    """統計每次 Gemini 請求的 prompt token 數：有 usage_metadata 時用實際值，否則粗估；
+    並拆出角色設定／對話紀錄／本次訊息各佔多少"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'estimated': 0, 'prompt_tokens': 0, 'output_tokens': 0,
+                      'history_tokens': 0, 'instruction_tokens': 0}
+        self.last = None
+
+    def record(self, response, contents, instruction: str, user_prompt: str, elapsed: float):
+        instruction_tokens = estimate_tokens(instruction)
+        message_tokens = estimate_tokens(user_prompt)
+        history_tokens = sum(estimate_tokens(part) for content in contents[:-1] for part in content['parts'])
+
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) if usage is not None else None
+        output_tokens = getattr(usage, 'candidates_token_count', None) if usage is not None else None
+        estimated = not prompt_tokens
+        if estimated:
+            prompt_tokens = instruction_tokens + history_tokens + message_tokens
+
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['estimated'] += int(estimated)
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['output_tokens'] += output_tokens or 0
+            self.stats['history_tokens'] += history_tokens
+            self.stats['instruction_tokens'] += instruction_tokens
+            self.last = prompt_tokens
+
+        safe_print(f"[AI] prompt tokens {prompt_tokens}{'（估計）' if estimated else ''}："
+                   f"角色設定 {instruction_tokens} / 對話紀錄 {history_tokens} / 訊息 {message_tokens}，"
+                   f"耗時 {elapsed * 1000:.0f}ms", "DEBUG")
+
+    def get_status(self) -> dict:
+        with self._lock:
+            requests_count = self.stats['requests']
+            average = lambda key: round(self.stats[key] / requests_count) if requests_count else 0
+            return {
+                'requests': requests_count,
+                'estimated_requests': self.stats['estimated'],
+                'last_prompt_tokens': self.last,
+                'avg_prompt_tokens': average('prompt_tokens'),
+                'avg_output_tokens': average('output_tokens'),
+                'avg_history_tokens': average('history_tokens'),
+                'avg_instruction_tokens': average('instruction_tokens'),
+            }
+
+
+prompt_token_stats = PromptTokenStats()
+
+
+def generate_ai_response(user_message: str, user_id: str, deadline: float = None):
+    """使用 Google Gemini 生成 AI 回應（🆕 常見短訊息先查快取）"""
+    try:
+        if not GOOGLE_AI_API_KEY:
+            safe_print("Google AI API Key 未設定", "WARNING")
+            return None
+
+        if deadline is not None and time.time() >= deadline:
+            # 在 ai_reply_pool 排隊時就已超過期限，不再送出請求
+            safe_print("AI 回應在排隊時已超過期限，改用備用回應", "WARNING")
+            return None
+
+        user_name = get_user_name(user_id)
+
+        # 正在連續對話時回應要接續上下文，不使用與上下文無關的快取回應；
+        # 隔了一段時間的早安、晚安等短訊息仍走快取，快取回應也不記入對話記憶
+        use_cache = AI_CACHE_ENABLED and not conversation_memory.has_recent_turn(user_id, AI_CACHE_CONTEXT_MINUTES * 60)
+        cache_key = ai_response_cache.make_key(get_ai_persona(user_name), user_message) if use_cache else None
+        if cache_key is not None:
+            cached_response = ai_response_cache.get(cache_key)
+            if cached_response is not None:
+                safe_print(f"AI 回應快取命中: {cache_key}", "DEBUG")
+                return cached_response
+
+        persona = get_ai_persona(user_name)
+        if persona == 'wife':
+            user_prompt = f"你最愛的騷鵝跟你說：{user_message}\n\n請用最甜蜜調情的語氣回應你的老婆騷鵝，用繁體中文。"
+        else:
+            user_prompt = f"用戶訊息（來自 {user_name}，user_id={user_id}）：{user_message}\n\n請以灰鵝的身份回應，記得適時提到你的老婆騷鵝，用繁體中文回答。"
+
+        # 🆕 角色設定已註冊在模型的 system_instruction，這裡只送對話紀錄與本次訊息
+        persona_model, instruction_in_model = get_persona_model(persona)
+        instruction = get_persona_instruction(persona)
+        contents = conversation_memory.build_contents(user_id, user_prompt)
+        request_contents = contents
+        if not instruction_in_model:
+            # 舊版 SDK 不支援 system_instruction，改在第一則訊息前加上指令；統計仍用原本的 contents，避免指令被算進歷史
+            first = contents[0]
+            request_contents = [{'role': first['role'], 'parts': [f"{instruction}\n\n{first['parts'][0]}"]}] + contents[1:]
 
         safe_print(f"開始生成 AI 回應給 {user_name}", "DEBUG")
-        response = model.generate_content(full_prompt)
+        response, elapsed = gemini_scheduler.call(timed_call, persona_model.generate_content, request_contents,
+                                                  priority=persona, deadline=deadline)
+        ai_response_cache.record_call(elapsed)
+        gemini_latency.record(elapsed)
+        prompt_token_stats.record(response, contents, instruction, user_prompt, elapsed)
 
         if response and getattr(response, "text", None):
             ai_response = response.text.strip()
             if len(ai_response) > 300:
                 ai_response = ai_response[:280].rstrip() + "..."
             safe_print(f"AI 回應生成成功，長度: {len(ai_response)} 字", "DEBUG")
+            if cache_key is not None:
+                ai_response_cache.put(cache_key, ai_response)
+            conversation_memory.add_exchange(user_id, user_message, ai_response)
             return ai_response
 
         safe_print("AI 回應為空", "WARNING")
@@ -1162,6 +4469,253 @@ def generate_ai_response(user_message: str, user_id: str):
         return None
 
 
+ai_reply_pool = ThreadPoolExecutor(max_workers=AI_REPLY_WORKERS, thread_name_prefix='ai-reply')
+ai_reply_stats = {'in_budget': 0, 'late_pushed': 0, 'late_failed': 0}
+
+
+def get_ai_ack_message(user_name: str) -> str:
+    """AI 回應超過時間預算時先回覆的簡短訊息"""
+    if user_name == '老婆':
+        return "💕 騷鵝寶貝等我一下下～灰鵝正在認真想要怎麼回你！"
+    return "🤔 讓我想一下，馬上回覆你！"
+
+
+def push_late_ai_response(future, user_id: str, user_name: str, start_time: float):
+    """超過時間預算的 AI 回應完成後以 push 補送（失敗時補送備用回應）"""
+    try:
+        ai_response = future.result()
+    except Exception as e:
+        safe_print(f"逾時的 AI 回應生成失敗：{e}", "ERROR")
+        ai_response = None
+
+    try:
+        line_bot_api.push_message(user_id, TextSendMessage(text=ai_response or get_fallback_response(user_name)))
+        ai_reply_stats['late_pushed' if ai_response else 'late_failed'] += 1
+        safe_print(f"已補送 AI 回應給 {user_name}（共 {time.time() - start_time:.1f} 秒）", "INFO")
+    except Exception as e:
+        safe_print(f"補送 AI 回應失敗：{e}", "ERROR")
+
+
+def generate_ai_reply_with_budget(user_message: str, user_id: str, user_name: str) -> str:
+    """🆕 在 AI_REPLY_BUDGET 秒內等待 AI 回應；逾時先返回簡短訊息（用 reply token 回覆），完成後再 push 補送"""
+    start_time = time.time()
+    future = ai_reply_pool.submit(generate_ai_response, user_message, user_id, start_time + AI_REPLY_DEADLINE)
+
+    try:
+        ai_response = future.result(timeout=AI_REPLY_BUDGET)
+    except FutureTimeoutError:
+        ai_reply_latency.record(time.time() - start_time)
+        safe_print(f"AI 回應超過 {AI_REPLY_BUDGET:g} 秒預算，先回覆簡短訊息，完成後再補送", "WARNING")
+        future.add_done_callback(lambda done: push_late_ai_response(done, user_id, user_name, start_time))
+        return get_ai_ack_message(user_name)
+
+    ai_reply_latency.record(time.time() - start_time)
+    ai_reply_stats['in_budget'] += 1
+    return ai_response or get_fallback_response(user_name)
+
+
+# ============== 🆕 預先生成的歡迎／關心訊息池 ==============
+
+class MessagePool:
+    """離峰時段批次生成的老婆歡迎／關心訊息：存在 SQLite 並記錄使用次數，
+    發送時從記憶體中的 deque 輪流取出（O(1)、不需網路），數量低於低水位時排入背景補充"""
+
+    PROMPTS = {
+        'welcome': "請一次寫 {count} 則不同的「騷鵝今天第一次來找灰鵝聊天」時的早安歡迎訊息，"
+                   "每則 2～4 行、60～150 字，語氣甜蜜調情，加上適量表情符號，不要提到具體日期或時間。",
+        'care': "請一次寫 {count} 則不同的「騷鵝已經 {{hours}} 小時沒跟灰鵝聊天」時的關心訊息，"
+                "每則 2～4 行、60～150 字，語氣撒嬌又關心她的近況，加上適量表情符號。"
+                "每則都必須原樣包含「{{hours}}」這個佔位字串，發送時會換成實際小時數。",
+    }
+
+    def __init__(self, db_path: str, target: int, low_water: int, max_uses: int, batch_size: int):
+        self.db_path = db_path
+        self.target = target
+        self.low_water = low_water
+        self.max_uses = max_uses
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pools = {kind: deque() for kind in self.PROMPTS}  # kind -> deque of [id, text, uses]
+        self._refill_pending = False
+        self._conn = None
+        self.stats = {'served': 0, 'fallbacks': 0, 'generated': 0, 'retired': 0, 'refills': 0, 'refill_failures': 0}
+        self._load()
+
+    def _load(self):
+        try:
+            self._conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS ai_message_pool (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        text TEXT NOT NULL,
+                        uses INTEGER NOT NULL DEFAULT 0,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL
+                    )
+                """)
+                self._conn.execute("DELETE FROM ai_message_pool WHERE uses >= ?", (self.max_uses,))
+            rows = self._conn.execute(
+                "SELECT id, kind, text, uses FROM ai_message_pool ORDER BY uses, id"
+            ).fetchall()
+            for message_id, kind, text, uses in rows:
+                if kind in self._pools:
+                    self._pools[kind].append([message_id, text, uses])
+            safe_print(f"已載入 {len(rows)} 則預先生成的訊息", "INFO")
+        except Exception as e:
+            safe_print(f"載入預先生成訊息失敗: {e}", "WARNING")
+            self._conn = None
+
+    def take(self, kind: str):
+        """取出一則訊息並增加使用次數；訊息池停用或是空的時返回 None"""
+        if not AI_MESSAGE_POOL_ENABLED:
+            return None
+
+        with self._lock:
+            pool = self._pools[kind]
+            if not pool:
+                self.stats['fallbacks'] += 1
+                entry = None
+            else:
+                entry = pool.popleft()
+                entry[2] += 1
+                if entry[2] < self.max_uses:
+                    pool.append(entry)
+                else:
+                    self.stats['retired'] += 1
+                self.stats['served'] += 1
+            needs_refill = len(pool) < self.low_water
+
+        if entry is not None:
+            self._record_use(entry)
+        if needs_refill:
+            self.request_refill()
+        return entry[1] if entry is not None else None
+
+    def _record_use(self, entry):
+        if self._conn is None:
+            return
+        try:
+            with self._lock, self._conn:
+                if entry[2] >= self.max_uses:
+                    self._conn.execute("DELETE FROM ai_message_pool WHERE id = ?", (entry[0],))
+                else:
+                    self._conn.execute("UPDATE ai_message_pool SET uses = ?, last_used_at = ? WHERE id = ?",
+                                       (entry[2], time.time(), entry[0]))
+        except Exception as e:
+            safe_print(f"更新訊息使用次數失敗: {e}", "WARNING")
+
+    def request_refill(self):
+        """排入背景補充（同時只會有一個補充工作）"""
+        with self._lock:
+            if self._refill_pending:
+                return None
+            self._refill_pending = True
+        try:
+            return job_executor.submit('message_pool_refill', self.refill)
+        except JobRejected:
+            with self._lock:
+                self._refill_pending = False
+            return None
+
+    def _generate(self, kind: str, count: int) -> list:
+        """請 Gemini 以老婆角色設定生成一批訊息，返回通過檢查的訊息"""
+        persona_model, instruction_in_model = get_persona_model('wife')
+        prompt = (self.PROMPTS[kind].format(count=count)
+                  + "\n\n只輸出 JSON 字串陣列，例如 [\"訊息1\", \"訊息2\"]，不要其他文字。")
+        if not instruction_in_model:
+            prompt = f"{get_persona_instruction('wife')}\n\n{prompt}"
+
+        response = gemini_scheduler.call(persona_model.generate_content, prompt, priority='background',
+                                         deadline=time.time() + AI_BACKGROUND_DEADLINE)
+        text = response.text.strip()
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+        messages = json.loads(text)
+
+        valid = []
+        for message in messages:
+            if not isinstance(message, str):
+                continue
+            message = message.strip()
+            if not 20 <= len(message) <= 300:
+                continue
+            if kind == 'care' and '{hours}' not in message:
+                continue
+            valid.append(message)
+        return valid
+
+    def refill(self, kinds=None) -> dict:
+        """把各類訊息補到目標數量，返回每類新增的數量"""
+        added = {}
+        try:
+            if not GOOGLE_AI_API_KEY:
+                safe_print("未設定 GOOGLE_AI_API_KEY，略過訊息池補充", "WARNING")
+                return added
+
+            for kind in kinds or self.PROMPTS:
+                added[kind] = 0
+                attempts = 0
+                while True:
+                    with self._lock:
+                        needed = self.target - len(self._pools[kind])
+                    if needed <= 0 or attempts >= 3 + self.target // max(1, self.batch_size):
+                        break
+                    attempts += 1
+                    try:
+                        messages = self._generate(kind, min(needed, self.batch_size))
+                    except Exception as e:
+                        self.stats['refill_failures'] += 1
+                        safe_print(f"生成 {kind} 訊息失敗: {e}", "WARNING")
+                        continue
+                    added[kind] += self._store(kind, messages[:needed])
+
+            self.stats['refills'] += 1
+            safe_print(f"訊息池補充完成：{added}", "INFO")
+            return added
+        finally:
+            with self._lock:
+                self._refill_pending = False
+
+    def _store(self, kind: str, messages: list) -> int:
+        created_at = time.time()
+        entries = []
+        for message in messages:
+            message_id = None
+            if self._conn is not None:
+                try:
+                    with self._lock, self._conn:
+                        message_id = self._conn.execute(
+                            "INSERT INTO ai_message_pool (kind, text, created_at) VALUES (?, ?, ?)",
+                            (kind, message, created_at)
+                        ).lastrowid
+                except Exception as e:
+                    safe_print(f"寫入預先生成訊息失敗: {e}", "WARNING")
+            entries.append([message_id, message, 0])
+
+        with self._lock:
+            # 新訊息放在最前面，優先於已用過的訊息
+            self._pools[kind].extendleft(reversed(entries))
+            self.stats['generated'] += len(entries)
+        return len(entries)
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': AI_MESSAGE_POOL_ENABLED,
+                'available': {kind: len(pool) for kind, pool in self._pools.items()},
+                'target': self.target,
+                'low_water': self.low_water,
+                'refill_pending': self._refill_pending,
+                **self.stats,
+            }
+
+
+message_pool = MessagePool(BOT_DB_PATH, AI_MESSAGE_POOL_TARGET, AI_MESSAGE_POOL_LOW_WATER,
+                           AI_MESSAGE_POOL_MAX_USES, AI_MESSAGE_POOL_BATCH)
+
+
 def should_use_ai_response(user_message: str) -> bool:
     """判斷是否應該使用 AI 回應"""
     existing_functions = [
@@ -1282,6 +4836,8 @@ def keep_alive():
 @app.route("/health", methods=['GET'])
 def health_check():
     """🆕 輕量級健康檢查（不執行任何重型任務，快速回應）"""
+    # 🆕 順便檢查是否該預熱抓取流程（只會排入背景工作）
+    prewarm_scheduler.tick()
     taiwan_time = get_taiwan_now()
     return jsonify({
         "status": "healthy",
@@ -1305,14 +4861,21 @@ def auto_attendance():
 
     try:
         # 在背景執行，避免阻塞 HTTP 回應
-        threading.Thread(target=send_daily_attendance_auto, daemon=True).start()
+        job_id = job_executor.submit('attendance', send_daily_attendance_auto)
 
         taiwan_time = get_taiwan_now()
         return jsonify({
             "status": "triggered",
             "message": "出勤查詢已觸發（背景執行中）",
+            "job_id": job_id,
             "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
         }), 200
+    except JobRejected as e:
+        execution_lock.reset('attendance')
+        return jsonify({
+            "status": "rejected",
+            "message": str(e)
+        }), 429
     except Exception as e:
         safe_print(f"自動出勤查詢觸發失敗：{e}", "ERROR")
         return jsonify({
@@ -1344,12 +4907,16 @@ def auto_work_reminder():
         }), 200
 
     try:
+        # 🆕 順便檢查是否該輪詢刷卡（實際下班後會取消剩餘提醒）
+        punch_poll = punch_poller.tick()
         work_manager.check_work_end_reminders()
         return jsonify({
             "status": "checked",
             "message": "下班提醒檢查完成",
             "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S'),
-            "work_end_time": work_manager.daily_work_end_time
+            "work_end_time": work_manager.daily_work_end_time,
+            "clocked_out_time": work_manager.clocked_out_time,
+            "punch_poll": punch_poll
         }), 200
     except Exception as e:
         safe_print(f"下班提醒檢查失敗：{e}", "ERROR")
@@ -1359,6 +4926,19 @@ def auto_work_reminder():
         }), 500
 
 
+@app.route("/auto/punch_poll", methods=['GET'])
+def auto_punch_poll():
+    """🆕 自動排程專用：下午打卡輪詢（可頻繁觸發，實際查詢間隔依距離下班時間調整）"""
+    taiwan_time = get_taiwan_now()
+    result = punch_poller.tick()
+    return jsonify({
+        "status": result.pop('status'),
+        "message": "打卡輪詢檢查完成",
+        "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S'),
+        **result
+    }), 200
+
+
 @app.route("/auto/holiday_check", methods=['GET'])
 def auto_holiday_check():
     """🆕 自動排程專用：節日檢查"""
@@ -1373,13 +4953,20 @@ def auto_holiday_check():
         }), 200
 
     try:
-        check_all_holidays()
+        job_id = job_executor.submit('holiday_check', check_all_holidays)
         taiwan_time = get_taiwan_now()
         return jsonify({
-            "status": "completed",
-            "message": "節日檢查完成",
+            "status": "triggered",
+            "message": "節日檢查已觸發（背景執行中）",
+            "job_id": job_id,
             "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
         }), 200
+    except JobRejected as e:
+        execution_lock.reset('holiday_check')
+        return jsonify({
+            "status": "rejected",
+            "message": str(e)
+        }), 429
     except Exception as e:
         safe_print(f"節日檢查失敗：{e}", "ERROR")
         return jsonify({
@@ -1392,13 +4979,19 @@ def auto_holiday_check():
 def auto_care_check():
     """🆕 自動排程專用：24小時關懷檢查"""
     try:
-        check_wife_inactive_and_send_care()
+        job_id = job_executor.submit('care_check', check_wife_inactive_and_send_care)
         taiwan_time = get_taiwan_now()
         return jsonify({
-            "status": "completed",
-            "message": "關懷檢查完成",
+            "status": "triggered",
+            "message": "關懷檢查已觸發（背景執行中）",
+            "job_id": job_id,
             "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
         }), 200
+    except JobRejected as e:
+        return jsonify({
+            "status": "rejected",
+            "message": str(e)
+        }), 429
     except Exception as e:
         safe_print(f"關懷檢查失敗：{e}", "ERROR")
         return jsonify({
@@ -1407,6 +5000,27 @@ def auto_care_check():
         }), 500
 
 
+@app.route("/auto/message_pool_refill", methods=['GET'])
+def auto_message_pool_refill():
+    """🆕 自動排程專用：補充預先生成的歡迎／關心訊息（建議在離峰時段觸發）"""
+    taiwan_time = get_taiwan_now()
+    job_id = message_pool.request_refill()
+    if job_id is None:
+        return jsonify({
+            "status": "skipped",
+            "message": "訊息池補充已在進行中或佇列已滿",
+            "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S'),
+            **message_pool.get_status()
+        }), 200
+
+    return jsonify({
+        "status": "triggered",
+        "message": "訊息池補充已觸發（背景執行中）",
+        "job_id": job_id,
+        "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
+    }), 200
+
+
 @app.route("/auto/daily_cleanup", methods=['GET'])
 def auto_daily_cleanup():
     """🆕 自動排程專用：每日清理"""
@@ -1426,6 +5040,125 @@ def auto_daily_cleanup():
         }), 500
 
 
+@app.route("/auto/attendance_cache/invalidate", methods=['GET'])
+def auto_attendance_cache_invalidate():
+    """🆕 清除出勤快取（可帶 employee_id、date=YYYY/M/D 參數，未帶參數則全部清除）"""
+    try:
+        removed = attendance_cache.invalidate(
+            employee_id=request.args.get('employee_id'),
+            date_str=request.args.get('date')
+        )
+        taiwan_time = get_taiwan_now()
+        return jsonify({
+            "status": "completed",
+            "message": f"已清除 {removed} 筆出勤快取",
+            "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
+        }), 200
+    except Exception as e:
+        safe_print(f"清除出勤快取失敗：{e}", "ERROR")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+def check_admin_token() -> bool:
+    """檢查管理端點的 token（未設定 ADMIN_TOKEN 時一律拒絕）"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.args.get('token', '').encode(), ADMIN_TOKEN.encode())
+
+
+@app.route("/admin/backfill", methods=['GET'])
+def admin_backfill():
+    """🆕 管理用：回補一段期間的出勤資料（start、end 為 YYYY-MM-DD，可帶 chunk_days、restart=1）"""
+    if not check_admin_token():
+        abort(403)
+
+    start_arg = request.args.get('start')
+    end_arg = request.args.get('end')
+    taiwan_time = get_taiwan_now()
+
+    if not start_arg or not end_arg:
+        return jsonify({
+            "status": "ok",
+            "backfill": attendance_backfill.get_status(),
+            "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
+        }), 200
+
+    try:
+        start_date = datetime.date.fromisoformat(start_arg)
+        end_date = datetime.date.fromisoformat(end_arg)
+        chunk_days = int(request.args.get('chunk_days', ATTENDANCE_BACKFILL_CHUNK_DAYS))
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"參數格式錯誤：{e}"
+        }), 400
+
+    if start_date > end_date:
+        return jsonify({
+            "status": "error",
+            "message": "start 不可晚於 end"
+        }), 400
+
+    try:
+        progress = attendance_backfill.start(start_date, end_date, chunk_days,
+                                             restart=request.args.get('restart') == '1')
+        return jsonify({
+            "status": "triggered",
+            "message": "出勤回補已觸發（背景執行中）",
+            "backfill": progress,
+            "time": taiwan_time.strftime('%Y-%m-%d %H:%M:%S')
+        }), 200
+    except Exception as e:
+        safe_print(f"出勤回補觸發失敗：{e}", "ERROR")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@app.route("/attendance/summary", methods=['GET'])
+def attendance_summary():
+    """🆕 從資料庫查詢出勤紀錄（period=week 或 month，可帶 employee_id）"""
+    if not check_admin_token():
+        abort(403)
+
+    period = request.args.get('period', 'week')
+    employee_id = request.args.get('employee_id', FUTAI_USERNAME)
+
+    try:
+        start_date, end_date = get_attendance_period(period)
+        records = attendance_store.get_range(employee_id, start_date, end_date)
+        average_start, days = attendance_store.get_average_start(employee_id, start_date, end_date)
+        return jsonify({
+            "status": "ok",
+            "period": period,
+            "start": start_date.isoformat(),
+            "end": end_date.isoformat(),
+            "average_work_start": average_start,
+            "days": days,
+            "records": records
+        }), 200
+    except Exception as e:
+        safe_print(f"查詢出勤紀錄失敗：{e}", "ERROR")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def job_status(job_id):
+    """🆕 查詢背景工作狀態"""
+    job = job_executor.get(job_id)
+    if job is None:
+        return jsonify({
+            "status": "not_found",
+            "message": f"找不到工作 {job_id}"
+        }), 404
+    return jsonify(job), 200
+
+
 # ============== Flask 基本路由 ==============
 
 @app.route("/", methods=['GET'])
@@ -1444,18 +5177,175 @@ def home():
     """
 
 
+class WebhookEventDeduplicator:
+    """🆕 記住最近處理過的 webhook 事件 ID（LRU + TTL），LINE 重送的事件在產生任何副作用前就略過"""
+
+    def __init__(self, capacity: int, ttl: int, db_path: str = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()  # event key -> 記錄時間
+        self._conn = None
+        self.stats = {'checked': 0, 'duplicates': 0, 'redeliveries': 0, 'evicted': 0}
+        if db_path:
+            self._load()
+
+    def _load(self):
+        """從 SQLite 載入 TTL 內的事件 ID"""
+        try:
+            self._conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS webhook_events (event_key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+                )
+                self._conn.execute("DELETE FROM webhook_events WHERE seen_at < ?", (time.time() - self.ttl,))
+            rows = self._conn.execute(
+                "SELECT event_key, seen_at FROM webhook_events ORDER BY seen_at DESC LIMIT ?", (self.capacity,)
+            ).fetchall()
+            for event_key, seen_at in reversed(rows):
+                self._seen[event_key] = seen_at
+            safe_print(f"已載入 {len(rows)} 筆 webhook 事件紀錄", "INFO")
+        except Exception as e:
+            safe_print(f"載入 webhook 事件紀錄失敗: {e}", "WARNING")
+            self._conn = None
+
+    def seen(self, event_key: str, redelivery: bool = False) -> bool:
+        """事件已處理過時返回 True；否則記錄下來並返回 False"""
+        current_time = time.time()
+        with self._lock:
+            self.stats['checked'] += 1
+            if redelivery:
+                self.stats['redeliveries'] += 1
+
+            seen_at = self._seen.get(event_key)
+            if seen_at is not None and current_time - seen_at <= self.ttl:
+                self._seen.move_to_end(event_key)
+                self.stats['duplicates'] += 1
+                return True
+
+            self._seen[event_key] = current_time
+            self._seen.move_to_end(event_key)
+            while len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+                self.stats['evicted'] += 1
+
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO webhook_events (event_key, seen_at) VALUES (?, ?)",
+                            (event_key, current_time)
+                        )
+                except Exception as e:
+                    safe_print(f"寫入 webhook 事件紀錄失敗: {e}", "WARNING")
+            return False
+
+    def clear_expired(self):
+        """清除過期的事件 ID（記憶體與資料庫）"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for event_key in [key for key, seen_at in self._seen.items() if seen_at < cutoff]:
+                del self._seen[event_key]
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM webhook_events WHERE seen_at < ?", (cutoff,))
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._seen),
+                'capacity': self.capacity,
+                'persisted': self._conn is not None,
+                **self.stats,
+            }
+
+
+webhook_dedup = WebhookEventDeduplicator(
+    WEBHOOK_DEDUP_SIZE, WEBHOOK_DEDUP_TTL, BOT_DB_PATH if WEBHOOK_DEDUP_PERSIST else None
+)
+
+
+def get_webhook_event_key(raw_event: dict) -> str:
+    """事件的去重 key：優先使用 webhookEventId，沒有時以訊息 ID（或事件類型與來源）加上時間戳記"""
+    if raw_event.get('webhookEventId'):
+        return raw_event['webhookEventId']
+    message_id = (raw_event.get('message') or {}).get('id')
+    if message_id:
+        return f"{message_id}:{raw_event.get('timestamp')}"
+    source = raw_event.get('source') or {}
+    return f"{raw_event.get('type')}:{source.get('userId') or source.get('groupId')}:{raw_event.get('timestamp')}"
+
+
+class ParsedPayloadParser:
+    """🆕 事件已在 /callback 驗證過簽章，背景處理時直接把解析好的 payload 交給 WebhookHandler 分派"""
+
+    @staticmethod
+    def parse(body, signature, as_payload=False):
+        return body
+
+
+# 與 handler 共用已註冊的事件處理函式，只換掉解析器
+event_dispatcher = WebhookHandler(CHANNEL_SECRET)
+event_dispatcher.parser = ParsedPayloadParser()
+event_dispatcher._handlers = handler._handlers
+
+
+def dispatch_webhook_event(event, destination):
+    """🆕 在背景執行緒中分派單一事件"""
+    event_dispatcher.handle(WebhookPayload(events=[event], destination=destination), None)
+
+
+# line-bot-sdk WebhookParser.parse 認得的事件類型（其他類型會被略過）
+LINE_SDK_EVENT_TYPES = frozenset({
+    'message', 'follow', 'unfollow', 'join', 'leave', 'postback', 'beacon', 'accountLink',
+    'memberJoined', 'memberLeft', 'things', 'unsend', 'videoPlayComplete',
+})
+
+
+def get_event_source_key(event) -> str:
+    """事件來源（使用者／群組）作為依序處理的 key"""
+    source = event.source
+    return (getattr(source, 'user_id', None) or getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None) or 'unknown')
+
+
 @app.route("/callback", methods=['POST'])
 def callback():
-    """Line Bot Webhook 回調"""
+    """Line Bot Webhook 回調（🆕 只驗證簽章並排入佇列，立即回應 200）"""
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
 
     try:
-        handler.handle(body, signature)
+        payload = handler.parser.parse(body, signature, as_payload=True)
     except InvalidSignatureError:
         safe_print("Invalid signature", "ERROR")
         abort(400)
 
+    # 🆕 SDK 的事件物件沒有 webhookEventId，從原始 JSON 取得；SDK 會略過未知類型的事件，
+    # 所以先用相同的類型清單過濾，兩邊才會一一對應
+    raw_events = [raw_event for raw_event in json.loads(body).get('events', [])
+                  if raw_event.get('type') in LINE_SDK_EVENT_TYPES]
+    if len(raw_events) != len(payload.events):
+        safe_print(f"webhook 原始事件數（{len(raw_events)}）與解析結果（{len(payload.events)}）不一致，本次不做重複檢查",
+                   "WARNING")
+        raw_events = [None] * len(payload.events)
+
+    for event, raw_event in zip(payload.events, raw_events):
+        if raw_event is not None:
+            redelivery = bool((raw_event.get('deliveryContext') or {}).get('isRedelivery'))
+            event_key = get_webhook_event_key(raw_event)
+            if webhook_dedup.seen(event_key, redelivery):
+                safe_print(f"略過重複的 webhook 事件 {event_key}（重送: {redelivery}）", "INFO")
+                continue
+
+        try:
+            webhook_queue.submit(get_event_source_key(event), dispatch_webhook_event, event, payload.destination)
+        except JobRejected:
+            safe_print("webhook 事件佇列已滿，改為直接處理", "WARNING")
+            dispatch_webhook_event(event, payload.destination)
+
     return 'OK'
 
 
@@ -1475,9 +5365,11 @@ def manual_check():
 def manual_attendance():
     """手動觸發出勤查詢"""
     try:
-        threading.Thread(target=send_daily_attendance_auto, daemon=True).start()
+        job_id = job_executor.submit('attendance', send_daily_attendance_auto)
         taiwan_time = get_taiwan_now()
-        return f"✅ 出勤查詢已觸發（背景執行中） (台灣時間: {taiwan_time.strftime('%Y-%m-%d %H:%M:%S')})", 200
+        return f"✅ 出勤查詢已觸發（背景執行中，工作 {job_id}） (台灣時間: {taiwan_time.strftime('%Y-%m-%d %H:%M:%S')})", 200
+    except JobRejected as e:
+        return f"⚠️ 查詢已在排隊中，請稍後再試：{e}", 429
     except Exception as e:
         safe_print(f"手動出勤查詢錯誤：{e}", "ERROR")
         return f"❌ 查詢失敗：{e}", 500
@@ -1523,7 +5415,33 @@ def status():
         "care_messages_sent_today": len(care_manager.care_messages_sent),
         "work_end_time": work_manager.daily_work_end_time,
         "work_reminders_sent": len(work_manager.work_end_reminders_sent),
+        "clocked_out_time": work_manager.clocked_out_time,
+        "punch_poller": punch_poller.get_status(),
+        "prewarm": prewarm_scheduler.get_status(),
         "daily_executed_tasks": list(daily_tracker.executed_today.keys()),
+        "job_executor": job_executor.get_status(),
+        "webhook_queue": webhook_queue.get_status(),
+        "webhook_dedup": webhook_dedup.get_status(),
+        "ai_response_cache": ai_response_cache.get_status(),
+        "ai_conversation_memory": conversation_memory.get_status(),
+        "ai_prompt_tokens": prompt_token_stats.get_status(),
+        "ai_reply": {
+            "budget_seconds": AI_REPLY_BUDGET,
+            **ai_reply_stats,
+            "reply_latency": ai_reply_latency.get_status(),
+            "gemini_latency": gemini_latency.get_status(),
+        },
+        "gemini_scheduler": gemini_scheduler.get_status(),
+        "ai_message_pool": message_pool.get_status(),
+        "attendance_backend": ATTENDANCE_BACKEND,
+        "futai_accounts": len(get_futai_accounts()),
+        "chrome_resource_blocking": CHROME_BLOCK_RESOURCES,
+        "scrape_worker": scrape_worker.get_status(),
+        "futai_circuit_breaker": futai_breaker.get_status(),
+        **({} if SCRAPE_WORKER_MODE == 'process' else get_scrape_worker_status()),
+        "attendance_cache": attendance_cache.get_status(),
+        "attendance_store": attendance_store.get_status(),
+        "attendance_single_flight": {**attendance_flight.stats, "in_flight": attendance_flight.in_flight()},
         "features": "節日提醒 + AI對話 + 出勤查詢 + 24小時關懷 + 每日歡迎 + 下班提醒",
     }
 
@@ -1541,6 +5459,9 @@ def daily_cleanup():
         welcome_manager.clear_old_records()
         care_manager.clear_old_records()
         work_manager.clear_work_end_records()
+        attendance_cache.clear_expired()
+        webhook_dedup.clear_expired()
+        conversation_memory.clear_idle()
 
         # 🆕 重置每日執行追蹤器（會在 _update_date 時自動清空）
         daily_tracker._update_date()
@@ -1583,27 +5504,32 @@ def handle_message(event):
         taiwan_time = get_taiwan_now()
         reply_text = f"🕐 台灣時間：{taiwan_time.strftime('%Y-%m-%d %H:%M:%S')}\n星期{['一', '二', '三', '四', '五', '六', '日'][taiwan_time.weekday()]}"
 
-    elif any(keyword in user_message for keyword in ['出勤', '查詢出勤', '刷卡', '上班時間', '下班時間']):
+    elif user_message in ['本週出勤', '本月出勤']:
         if user_id == YOUR_USER_ID:
-            threading.Thread(target=send_daily_attendance_for_husband, daemon=True).start()
-            reply_text = "📋 正在查詢灰鵝今日出勤資料，請稍候...\n系統將在查詢完成後自動發送結果給您"
-            safe_print("📋 老公啟動出勤查詢", "INFO")
-        elif user_id == WIFE_USER_ID:
-            threading.Thread(target=send_daily_attendance_for_wife, daemon=True).start()
-            reply_text = "💕 騷鵝寶貝想知道灰鵝的工作狀況嗎？\n正在幫你查詢灰鵝今天的出勤資料～請稍等一下下哦！"
-            safe_print("📋 騷鵝啟動灰鵝出勤查詢", "INFO")
+            reply_text = build_attendance_summary_message('month' if user_message == '本月出勤' else 'week')
         else:
-            threading.Thread(target=send_daily_attendance_for_husband, daemon=True).start()
-            reply_text = "📋 正在查詢灰鵝今日出勤資料，請稍候...\n系統將在查詢完成後自動發送結果給您"
-            safe_print("📋 其他用戶啟動出勤查詢", "INFO")
+            reply_text = "🔒 出勤歷史紀錄只有灰鵝本人可以查詢哦～"
+
+    elif any(keyword in user_message for keyword in ['出勤', '查詢出勤', '刷卡', '上班時間', '下班時間']):
+        try:
+            if user_id == YOUR_USER_ID:
+                job_executor.submit('attendance', send_daily_attendance_for_husband)
+                reply_text = "📋 正在查詢灰鵝今日出勤資料，請稍候...\n系統將在查詢完成後自動發送結果給您"
+                safe_print("📋 老公啟動出勤查詢", "INFO")
+            elif user_id == WIFE_USER_ID:
+                job_executor.submit('attendance', send_daily_attendance_for_wife)
+                reply_text = "💕 騷鵝寶貝想知道灰鵝的工作狀況嗎？\n正在幫你查詢灰鵝今天的出勤資料～請稍等一下下哦！"
+                safe_print("📋 騷鵝啟動灰鵝出勤查詢", "INFO")
+            else:
+                job_executor.submit('attendance', send_daily_attendance_for_husband)
+                reply_text = "📋 正在查詢灰鵝今日出勤資料，請稍候...\n系統將在查詢完成後自動發送結果給您"
+                safe_print("📋 其他用戶啟動出勤查詢", "INFO")
+        except JobRejected:
+            reply_text = "⏳ 目前出勤查詢排隊中的請求太多了，請稍後再試一次～"
 
     else:
         if should_use_ai_response(user_message):
-            ai_response = generate_ai_response(user_message, user_id)
-            if ai_response:
-                reply_text = ai_response
-            else:
-                reply_text = get_fallback_response(user_name)
+            reply_text = generate_ai_reply_with_budget(user_message, user_id, user_name)
         else:
             reply_text = get_fallback_response(user_name)
 
@@ -1653,6 +5579,7 @@ def get_help_message():
 
 💼 出勤查詢：
 回覆「出勤」可查詢今日出勤狀態
+回覆「本週出勤」或「本月出勤」可查看歷史紀錄與平均上班時間（僅限老公）
 • 老公：收到詳細出勤資料 + 下班提醒設定
 • 騷鵝：收到溫馨版灰鵝出勤資料
 
@@ -1664,6 +5591,7 @@ def get_help_message():
 • 24小時關懷：超過24小時沒對話會主動關心
 • 每日歡迎：每天第一次使用會有特別歡迎訊息
 • 智能下班提醒：會在預估下班時間前多次提醒（1小時、30分鐘、10分鐘、5分鐘前）
+• 下班偵測：下午會自動檢查刷卡，偵測到下班刷卡就通知並取消剩餘提醒
 
 🏗️ 新架構特色：
 • 外部觸發模式，不受休眠影響
@@ -1706,6 +5634,15 @@ def setup_schedules():
     # 每日清理
     schedule.every().day.at("01:00").do(daily_cleanup)
 
+    # 🆕 下午打卡輪詢（tick 只在到期時才實際查詢）
+    schedule.every(1).minutes.do(punch_poller.tick)
+
+    # 🆕 在預定觸發前預熱抓取流程，沒等到觸發就關閉
+    schedule.every(1).minutes.do(prewarm_scheduler.tick)
+
+    # 🆕 離峰時段補充預先生成的歡迎／關心訊息
+    schedule.every().day.at(AI_MESSAGE_POOL_REFILL_TIME).do(message_pool.request_refill)
+
     safe_print("✅ 備援排程任務設定完成（主要依賴外部觸發）", "INFO")
 
 
@@ -1772,6 +5709,10 @@ if __name__ == "__main__":
     keep_alive_thread.start()
     safe_print("✅ 自我喚醒執行緒已啟動（10分鐘間隔）", "INFO")
 
+    # 🆕 背景預先建立 Chrome 連線池（process 模式下在抓取子程序中建立）
+    job_executor.submit('warm', run_scrape_job, 'warm')
+    safe_print(f"✅ Chrome 連線池預熱中（大小 {CHROME_POOL_SIZE}）", "INFO")
+
     # 啟動 Flask 應用
     port = int(os.environ.get('PORT', 5000))
     safe_print(f"=== ✅ 智能生活助手啟動完成，監聽 port {port} ===", "INFO")
@@ -1779,9 +5720,11 @@ if __name__ == "__main__":
     safe_print(f"  • /health - 每 5 分鐘", "INFO")
     safe_print(f"  • /auto/attendance - 09:30, 10:00", "INFO")
     safe_print(f"  • /auto/work_reminder - 每 5 分鐘", "INFO")
+    safe_print(f"  • /auto/punch_poll - 每 1~5 分鐘（14:00 後）", "INFO")
     safe_print(f"  • /auto/holiday_check - 09:00, 12:00, 18:00, 21:00", "INFO")
     safe_print(f"  • /auto/care_check - 每 2 小時", "INFO")
     safe_print(f"  • /auto/daily_cleanup - 01:00", "INFO")
+    safe_print(f"  • /auto/message_pool_refill - {AI_MESSAGE_POOL_REFILL_TIME}", "INFO")
 
     # 啟動時執行一次節日檢查
     try:
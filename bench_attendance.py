@@ -0,0 +1,188 @@
+"""
+出勤抓取端到端效能測試
+
+對重播伺服器（futai_replay_server.py）或指定的入口網站反覆執行出勤查詢，
+統計各階段（driver_start / login / navigation / query / parse）平均耗時、整體 p50/p95 延遲與峰值記憶體。
+
+使用方式：
+    python bench_attendance.py --start-server --iterations 20
+    python bench_attendance.py --start-server --backend http --cold --json
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+STAGES = ('driver_start', 'login', 'navigation', 'query', 'parse')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def wait_for_server(url, timeout=10):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.1)
+    return False
+
+
+class PeakRssSampler:
+    """背景取樣本程序（含 Chrome 子程序）的 RSS"""
+
+    def __init__(self, app_module, interval=0.05):
+        self.app_module = app_module
+        self.interval = interval
+        self.peak_mb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss_mb = self.app_module.get_process_tree_rss_mb(os.getpid())
+            if rss_mb:
+                self.peak_mb = max(self.peak_mb, rss_mb)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def reset_state(app_module, backend):
+    """冷啟動：清除已保存的登入狀態與常駐瀏覽器"""
+    app_module.futai_cookie_jar.clear()
+    if backend == 'http':
+        app_module.futai_http_client.session.cookies.clear()
+    else:
+        app_module.chrome_pool.shutdown()
+
+
+def run_backend(app_module, backend, iterations, cold):
+    fetch = {
+        'http': app_module.get_futai_attendance_http,
+        'selenium': app_module.get_futai_attendance_selenium,
+    }[backend]
+
+    latencies = []
+    stage_totals = {stage: [] for stage in STAGES}
+    failures = 0
+
+    with PeakRssSampler(app_module) as sampler:
+        for _ in range(iterations):
+            if cold:
+                reset_state(app_module, backend)
+
+            start_time = time.perf_counter()
+            with app_module.scrape_stages.collect() as stages:
+                result = fetch()
+            latencies.append(time.perf_counter() - start_time)
+
+            if not result:
+                failures += 1
+            for stage in STAGES:
+                stage_totals[stage].append(stages.get(stage, 0))
+
+    if backend == 'selenium':
+        app_module.chrome_pool.shutdown()
+
+    return {
+        'backend': backend,
+        'iterations': iterations,
+        'cold': cold,
+        'failures': failures,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+        'stages_ms': {stage: round(statistics.mean(values) * 1000, 1) for stage, values in stage_totals.items()},
+        'peak_rss_mb': round(sampler.peak_mb, 1),
+    }
+
+
+def print_report(report):
+    print(f"\n=== {report['backend']} ({'cold' if report['cold'] else 'warm'}, "
+          f"{report['iterations']} 次, 失敗 {report['failures']}) ===")
+    print(f"p50 {report['p50_ms']} ms / p95 {report['p95_ms']} ms / 平均 {report['mean_ms']} ms")
+    for stage, value in report['stages_ms'].items():
+        print(f"  {stage:<13}{value:>10} ms")
+    print(f"峰值 RSS: {report['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='出勤抓取端到端效能測試')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8765', help='重播伺服器（或入口網站）網址')
+    parser.add_argument('--start-server', action='store_true', help='自動啟動 futai_replay_server.py')
+    parser.add_argument('--latency-ms', type=int, default=0, help='自動啟動的重播伺服器每個請求的延遲')
+    parser.add_argument('--fixtures', help='自動啟動的重播伺服器使用的錄製結果頁目錄')
+    parser.add_argument('--backend', choices=['http', 'selenium', 'all'], default='all')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--cold', action='store_true', help='每次都清除登入狀態並重新啟動瀏覽器')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_attendance_')
+    os.environ.update({
+        'FUTAI_EPORTAL_BASE': args.base_url,
+        'FUTAI_BPMFLOW_BASE': args.base_url,
+        'FUTAI_USERNAME': os.environ.get('FUTAI_USERNAME', '2993'),
+        'FUTAI_PASSWORD': os.environ.get('FUTAI_PASSWORD', 'bench'),
+        'SCRAPE_WORKER_MODE': 'inline',
+        'BOT_DB_PATH': os.path.join(work_dir, 'bot_data.db'),
+        'FUTAI_COOKIE_FILE': os.path.join(work_dir, 'futai_session.bin'),
+        'CHANNEL_ACCESS_TOKEN': os.environ.get('CHANNEL_ACCESS_TOKEN', 'bench'),
+        'CHANNEL_SECRET': os.environ.get('CHANNEL_SECRET', 'bench'),
+    })
+
+    server = None
+    if args.start_server:
+        port = args.base_url.rsplit(':', 1)[-1].strip('/')
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'futai_replay_server.py'),
+                   '--port', port, '--latency-ms', str(args.latency_ms)]
+        if args.fixtures:
+            command += ['--fixtures', args.fixtures]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_for_server(args.base_url):
+            server.terminate()
+            sys.exit("重播伺服器啟動失敗")
+
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        backends = ['http', 'selenium'] if args.backend == 'all' else [args.backend]
+        # 以 JSON 輸出時，把 app 的日誌導到 stderr，stdout 只留結果
+        with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+            import app as app_module
+            reports = [run_backend(app_module, backend, args.iterations, args.cold) for backend in backends]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+
+
+if __name__ == '__main__':
+    main()
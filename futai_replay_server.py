@@ -0,0 +1,185 @@
+"""
+富台 eportal / bpmflow 重播伺服器
+
+模擬出勤查詢會經過的頁面（登入表單 → SignOn 轉址 → AB-ABS-04 查詢頁 → 查詢結果表格），
+讓 HTTP 與 Selenium 兩種抓取後端可以在沒有真實入口網站的環境下做端到端效能測試。
+
+使用方式：
+    python futai_replay_server.py --port 8765 --latency-ms 150
+    FUTAI_EPORTAL_BASE=http://127.0.0.1:8765 FUTAI_BPMFLOW_BASE=http://127.0.0.1:8765 python app.py
+
+--fixtures 可指定錄製下來的結果頁目錄（檔名為 YYYY-MM-DD.html），查詢單日時直接回傳該檔內容；
+沒有對應檔案時依日期產生固定的假資料。
+"""
+import argparse
+import datetime
+import hashlib
+import html
+import os
+import secrets
+import time
+
+from flask import Flask, request, redirect, make_response
+
+AUTH_COOKIE = '.ASPXAUTH'
+SIGNON_PATH = '/futaibpmflow/SignOnFutai.aspx'
+QUERY_PATH = '/futaibpmflow/AB/AB-ABS-04.aspx'
+
+app = Flask(__name__)
+app.config['FIXTURES_DIR'] = None
+app.config['LATENCY_MS'] = 0
+app.config['EMPLOYEES'] = [('2993', '測試員工'), ('3001', '王小明'), ('3002', '陳小華')]
+
+sessions = {}
+
+
+def simulate_latency():
+    latency_ms = app.config['LATENCY_MS']
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+
+
+def current_account():
+    return sessions.get(request.cookies.get(AUTH_COOKIE))
+
+
+def parse_futai_date(value: str):
+    try:
+        return datetime.datetime.strptime(value.strip(), '%Y/%m/%d').date()
+    except (ValueError, AttributeError):
+        return None
+
+
+def synthetic_times(employee_id: str, date: datetime.date):
+    """依員工與日期產生固定的刷卡時間"""
+    seed = int(hashlib.md5(f"{employee_id}:{date.isoformat()}".encode()).hexdigest(), 16)
+    start_minutes = 7 * 60 + 30 + seed % 90
+    end_minutes = start_minutes + 9 * 60 + (seed >> 8) % 60
+    return [f"{start_minutes // 60:02d}:{start_minutes % 60:02d}",
+            f"{end_minutes // 60:02d}:{end_minutes % 60:02d}"]
+
+
+def render_result_table(account: str, start_date, end_date) -> str:
+    employees = list(app.config['EMPLOYEES'])
+    if account not in {employee_id for employee_id, _ in employees}:
+        employees.insert(0, (account, '登入帳號'))
+
+    rows = ['<tr><td>工號</td><td>姓名</td><td>日期</td><td>刷卡1</td><td>刷卡2</td><td>備註</td></tr>']
+    date = start_date
+    while date <= end_date:
+        for employee_id, name in employees:
+            times = synthetic_times(employee_id, date)
+            cells = [employee_id, name, date.strftime('%Y/%m/%d')] + times + ['']
+            rows.append('<tr>' + ''.join(f'<td>{html.escape(cell)}</td>' for cell in cells) + '</tr>')
+        date += datetime.timedelta(days=1)
+    return '<table width="566" border="1">' + ''.join(rows) + '</table>'
+
+
+def load_fixture(start_date, end_date):
+    fixtures_dir = app.config['FIXTURES_DIR']
+    if not fixtures_dir or start_date != end_date:
+        return None
+    path = os.path.join(fixtures_dir, f"{start_date.isoformat()}.html")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def render_query_page(start_str: str = '', end_str: str = '', result: str = '') -> str:
+    view_state = secrets.token_urlsafe(48)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>AB-ABS-04 出勤查詢</title></head>
+<body>
+<form method="post" action="{QUERY_PATH}" id="form1">
+  <input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{view_state}">
+  <input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{secrets.token_urlsafe(24)}">
+  <input type="text" name="FindDate" id="FindDate" value="{html.escape(start_str)}">
+  <input type="text" name="FindEDate" id="FindEDate" value="{html.escape(end_str)}">
+  <input type="submit" name="Submit" value="查詢">
+</form>
+{result}
+</body></html>"""
+
+
+@app.route('/Home/Login', methods=['GET'])
+def login_page():
+    simulate_latency()
+    token = secrets.token_urlsafe(32)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Futai ePortal</title></head>
+<body>
+<form method="post" action="/Home/Login?ReturnUrl=%2F">
+  <input type="hidden" name="__RequestVerificationToken" value="{token}">
+  <input type="text" name="Account" id="Account">
+  <input type="password" name="Pwd" id="Pwd">
+  <input type="submit" value="登入">
+</form>
+</body></html>"""
+
+
+@app.route('/Home/Login', methods=['POST'])
+def login_submit():
+    simulate_latency()
+    account = request.form.get('Account', '').strip()
+    if not account or not request.form.get('Pwd') or not request.form.get('__RequestVerificationToken'):
+        return redirect('/Home/Login?ReturnUrl=%2F')
+
+    session_id = secrets.token_hex(16)
+    sessions[session_id] = account
+    response = make_response(redirect('/'))
+    response.set_cookie(AUTH_COOKIE, session_id, httponly=True)
+    return response
+
+
+@app.route('/')
+def home():
+    if current_account() is None:
+        return redirect('/Home/Login?ReturnUrl=%2F')
+    return '<html><body>ePortal</body></html>'
+
+
+@app.route(SIGNON_PATH)
+def sign_on():
+    simulate_latency()
+    if current_account() is None:
+        return redirect('/Home/Login?ReturnUrl=%2F')
+    return redirect(QUERY_PATH)
+
+
+@app.route(QUERY_PATH, methods=['GET', 'POST'])
+def query_page():
+    simulate_latency()
+    account = current_account()
+    if account is None:
+        return redirect('/Home/Login?ReturnUrl=%2F')
+
+    if request.method == 'GET':
+        return render_query_page()
+
+    start_str = request.form.get('FindDate', '')
+    end_str = request.form.get('FindEDate', '')
+    start_date = parse_futai_date(start_str)
+    end_date = parse_futai_date(end_str)
+    if not request.form.get('__VIEWSTATE') or start_date is None or end_date is None:
+        return render_query_page(start_str, end_str, '<p>查詢條件錯誤</p>')
+
+    result = load_fixture(start_date, end_date) or render_result_table(account, start_date, end_date)
+    return render_query_page(start_str, end_str, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='富台入口網站重播伺服器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=int, default=0, help='每個請求額外延遲的毫秒數')
+    parser.add_argument('--fixtures', help='錄製的結果頁目錄（YYYY-MM-DD.html）')
+    args = parser.parse_args()
+
+    app.config['LATENCY_MS'] = args.latency_ms
+    app.config['FIXTURES_DIR'] = args.fixtures
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
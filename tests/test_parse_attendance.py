@@ -0,0 +1,56 @@
+"""lxml 與 BeautifulSoup 出勤解析器的 golden fixture 比對"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_work_dir = tempfile.mkdtemp(prefix='stock_env_tests_')
+os.environ.setdefault('CHANNEL_ACCESS_TOKEN', 'test')
+os.environ.setdefault('CHANNEL_SECRET', 'test')
+os.environ.setdefault('BOT_DB_PATH', os.path.join(_work_dir, 'bot_data.db'))
+os.environ.setdefault('FUTAI_COOKIE_FILE', os.path.join(_work_dir, 'futai_session.bin'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app  # noqa: E402
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures' / 'attendance'
+FIXTURES = sorted(FIXTURES_DIR.glob('*.html'))
+
+
+@pytest.mark.parametrize('fixture', FIXTURES, ids=[path.stem for path in FIXTURES])
+def test_lxml_parser_matches_bs4(fixture):
+    html_content = fixture.read_text(encoding='utf-8')
+    assert app.parse_attendance_html_lxml(html_content) == app.parse_attendance_html_bs4(html_content)
+
+
+@pytest.mark.parametrize('fixture', FIXTURES, ids=[path.stem for path in FIXTURES])
+def test_lxml_parser_matches_bs4_on_bytes(fixture):
+    html_bytes = fixture.read_bytes()
+    assert app.parse_attendance_html_lxml(html_bytes) == app.parse_attendance_html_bs4(html_bytes)
+
+
+def test_basic_fixture_contents():
+    attendance = app.parse_attendance_html_lxml((FIXTURES_DIR / 'basic.html').read_text(encoding='utf-8'))
+    assert attendance == {
+        '2993': {'name': '測試員工', 'date': '2024/3/5', 'times': ['08:12', '17:45'],
+                 'work_start': '08:12', 'work_end': '17:12'},
+        '3001': {'name': '王小明', 'date': '2024/3/5', 'times': ['07:58'],
+                 'work_start': '07:58', 'work_end': '16:58'},
+    }
+
+
+def test_messy_fixture_contents():
+    attendance = app.parse_attendance_html_lxml((FIXTURES_DIR / 'messy.html').read_text(encoding='utf-8'))
+    assert attendance['2993']['name'] == '測試員工'
+    assert attendance['2993']['times'] == ['08:31', '18:02']
+    assert attendance['3001']['times'] == ['07:45', '12:01']
+    assert '3003' not in attendance
+
+
+def test_empty_table_and_missing_table():
+    empty = (FIXTURES_DIR / 'empty_table.html').read_text(encoding='utf-8')
+    missing = (FIXTURES_DIR / 'no_table.html').read_text(encoding='utf-8')
+    assert app.parse_attendance_html_lxml(empty) == {}
+    assert app.parse_attendance_html_lxml(missing) is None